@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Describing loaded nodes, as done by json-dump-tree.
+
+Builds a device tree in an (unconnected) ObjectStore and times
+dictDescribe per node, and writing the descriptions of the loaded
+tree to /dev/null with a jsondump.DumpWriter (as dump_tree does).
+
+usage: python benchmarks/bench_describe.py [num-devices]
+"""
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+import siptracklib
+import siptracklib.root
+from siptracklib import jsondump
+
+def node_data(oid, parent, class_id, data):
+    return {'oid': oid, 'parent': parent, 'class_id': class_id,
+            'data': data, 'associations': [], 'references': [],
+            'ctime': 1300000000}
+
+def generate_tree(num_devices):
+    """Generate node data: devices with a mix of attribute types."""
+    yield node_data('1', '0', 'V', [])
+    yield node_data('2', '1', 'DT', [])
+    oid = 10
+    for n in xrange(num_devices):
+        yield node_data(str(oid), '2', 'D', [])
+        yield node_data(str(oid + 1), str(oid), 'CA',
+                ['name', 'text', u'device-%d.example.com' % n])
+        yield node_data(str(oid + 2), str(oid), 'CA',
+                ['description', 'text', 'benchmark device %d ' % n * 20])
+        yield node_data(str(oid + 3), str(oid), 'CA',
+                ['rack-unit', 'int', n % 42])
+        yield node_data(str(oid + 4), str(oid), 'CA',
+                ['monitored', 'bool', n % 2 == 0])
+        oid += 5
+
+def timed(name, func, count):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-24s %8.3fs %10.0f/s' % (name, elapsed, count / elapsed)
+
+def main():
+    num_devices = 50000
+    if len(sys.argv) > 1:
+        num_devices = int(sys.argv[1])
+    transport = siptracklib.transports['default']('localhost', 0, False)
+    object_store = siptracklib.root.ObjectStore(transport)
+    object_store.loadChildren(list(generate_tree(num_devices)))
+    nodes = list(object_store.view_tree.traverse(include_self = False))
+    num_nodes = len(nodes)
+
+    def per_node():
+        for node in nodes:
+            node.dictDescribe()
+    def dump():
+        devnull = open(os.devnull, 'w')
+        writer = jsondump.DumpWriter(devnull, 'json')
+        for node in nodes:
+            writer.write(node.dictDescribe())
+        writer.close()
+
+    print 'nodes: %d' % (num_nodes)
+    timed('per node', per_node, num_nodes)
+    timed('json dump', dump, num_nodes)
+
+if __name__ == '__main__':
+    main()
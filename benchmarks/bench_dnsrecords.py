@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Adding records to siptrack-generate-dns DNSRecords.
+
+Adds generated A records, all in one forward zone, and PTR records
+(with some overriding duplicates) the way siptrack-generate-dns does
+for large zones, and writes the resulting zones.
+
+usage: python benchmarks/bench_dnsrecords.py [num-hosts]
+"""
+import sys
+import os
+import time
+import imp
+import tempfile
+import shutil
+
+tools_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+        'tools')
+sys.path.insert(0, os.path.join(tools_dir, '..'))
+
+generate_dns = imp.load_source('generate_dns',
+        os.path.join(tools_dir, 'siptrack-generate-dns'))
+
+def generate_records(num_hosts):
+    """Generate A/PTR records, every tenth host is overridden later."""
+    records = []
+    for n in xrange(num_hosts):
+        address = '10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255)
+        hostname = 'host%d.example.com' % (n)
+        records.append((generate_dns.ARecord(hostname, address), False))
+        records.append((generate_dns.PTRRecord(
+            generate_dns.ipv4_reverse(address), hostname), False))
+    for n in xrange(0, num_hosts, 10):
+        address = '10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255)
+        records.append((generate_dns.PTRRecord(
+            generate_dns.ipv4_reverse(address), 'alias%d.example.com' % (n)),
+            True))
+    return records
+
+def timed(name, func, count):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-24s %8.3fs %10.0f/s' % (name, elapsed, count / elapsed)
+
+def main():
+    num_hosts = 60000
+    if len(sys.argv) > 1:
+        num_hosts = int(sys.argv[1])
+    records = generate_records(num_hosts)
+    dnsrecords = generate_dns.DNSRecords()
+    output_dir = tempfile.mkdtemp()
+
+    def add():
+        for record, override in records:
+            dnsrecords.addRecord(record, override)
+    def write():
+        dnsrecords.writeZones(output_dir)
+
+    print 'hosts: %d, records: %d' % (num_hosts, len(records))
+    try:
+        timed('add records', add, len(records))
+        timed('write zones', write, len(records))
+    finally:
+        shutil.rmtree(output_dir)
+
+if __name__ == '__main__':
+    main()
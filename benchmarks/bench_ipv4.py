@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Parsing and printing of ipv4 addresses.
+
+Times the siptracklib.network.ipv4 conversions used when loading and
+displaying networks: parsing address strings, printing addresses and
+netmask/prefix length conversions.
+
+usage: python benchmarks/bench_ipv4.py [num-addresses]
+"""
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from siptracklib.network import ipv4
+
+def generate_addresses(num_addresses):
+    """Generate address strings with a mix of prefix lengths."""
+    for n in xrange(num_addresses):
+        yield '10.%d.%d.%d/%d' % (n >> 16 & 255, n >> 8 & 255, n & 255,
+                32 - (n % 25))
+
+def timed(name, func, count):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-24s %8.3fs %10.0f/s' % (name, elapsed, count / elapsed)
+
+def main():
+    num_addresses = 1000000
+    if len(sys.argv) > 1:
+        num_addresses = int(sys.argv[1])
+    strings = list(generate_addresses(num_addresses))
+    hosts = [string.split('/')[0] for string in strings]
+    addresses = []
+    netmasks = [ipv4.bitcount_to_num(32 - (n % 33))
+            for n in xrange(num_addresses)]
+    bitcounts = [n % 33 for n in xrange(num_addresses)]
+
+    def parse_cidr():
+        addresses.extend(ipv4.address_from_string(string)
+            for string in strings)
+    def parse_host():
+        for host in hosts:
+            ipv4.dotted_quad_to_num(host)
+    def print_cidr():
+        for address in addresses:
+            str(address)
+    def print_pretty():
+        for address in addresses:
+            address.printablePretty()
+    def netmask_to_bitcount():
+        num_to_bitcount = addresses[0].numToBitcount
+        for netmask in netmasks:
+            num_to_bitcount(netmask)
+    def bitcount_to_netmask():
+        bitcount_to_num = ipv4.bitcount_to_num
+        for bitcount in bitcounts:
+            bitcount_to_num(bitcount)
+
+    print 'addresses: %d' % (num_addresses)
+    timed('parse cidr', parse_cidr, num_addresses)
+    timed('parse host', parse_host, num_addresses)
+    timed('print cidr', print_cidr, num_addresses)
+    timed('print pretty', print_pretty, num_addresses)
+    timed('netmask to bitcount', netmask_to_bitcount, num_addresses)
+    timed('bitcount to netmask', bitcount_to_netmask, num_addresses)
+
+if __name__ == '__main__':
+    main()
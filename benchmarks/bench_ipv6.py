@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Loading, sorting and printing of ipv6 networks.
+
+Loads generated ipv6 host networks into an (unconnected) ObjectStore,
+sorts them and prints them, the work done when listing or dumping an
+ipv6 network tree. Also allocates free hosts in a network holding a
+network range, checking that none of them fall inside the range.
+
+usage: python benchmarks/bench_ipv6.py [num-networks]
+"""
+import sys
+import os
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+import siptracklib
+import siptracklib.root
+from siptracklib.network import ipv6
+from siptracklib.network.allocator import Allocator
+
+num_allocate = 1000
+
+def node_data(oid, parent, class_id, data):
+    return {'oid': oid, 'parent': parent, 'class_id': class_id,
+            'data': data, 'associations': [], 'references': [],
+            'ctime': 1300000000}
+
+def generate_tree(num_networks):
+    """Generate node data: an ipv6 network tree with host networks."""
+    yield node_data('1', '0', 'V', [])
+    yield node_data('2', '1', 'NT', ['ipv6'])
+    yield node_data('3', '2', 'IP6N', ['2001:db9::/64'])
+    yield node_data('4', '3', 'IP6NR', ['2001:db9::1 2001:db9::1ff'])
+    yield node_data('5', '3', 'IP6N', ['2001:db9::200/128'])
+    hosts = range(num_networks)
+    random.seed(0)
+    random.shuffle(hosts)
+    for n, host in enumerate(hosts):
+        yield node_data(str(n + 10), '2', 'IP6N',
+                ['2001:db8:%x:%x::%x/128' % (host >> 32 & 0xffff,
+                    host >> 16 & 0xffff, host & 0xffff)])
+
+def timed(name, func, count):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-24s %8.3fs %10.0f/s' % (name, elapsed, count / elapsed)
+
+def main():
+    num_networks = 200000
+    if len(sys.argv) > 1:
+        num_networks = int(sys.argv[1])
+    transport = siptracklib.transports['default']('localhost', 0, False)
+    object_store = siptracklib.root.ObjectStore(transport)
+    data = list(generate_tree(num_networks))
+
+    def load():
+        object_store.loadChildren(data)
+    def sort():
+        network_tree.sorted_children = False
+        network_tree.sortChildren()
+    def printable():
+        for network in network_tree.children:
+            str(network.address)
+    def allocate():
+        network = object_store.getOID('3')
+        network.fetched_children = True
+        hosts = Allocator(network).allocateHosts(num_allocate)
+        start = ipv6.string_to_num('2001:db9::')
+        if hosts[0].start != start or hosts[1].start != start + 0x201:
+            raise AssertionError('allocated hosts overlap existing '
+                    'range/network: %s, %s' % (hosts[0], hosts[1]))
+
+    print 'networks: %d' % (num_networks)
+    timed('load', load, num_networks)
+    network_tree = object_store.getOID('2')
+    timed('sort', sort, num_networks)
+    timed('print', printable, num_networks)
+    timed('allocate', allocate, num_allocate)
+
+if __name__ == '__main__':
+    main()
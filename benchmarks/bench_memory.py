@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Memory use of loaded tree nodes.
+
+Builds a device tree and a network tree in an (unconnected) ObjectStore
+from generated node data and reports the number of bytes used per node.
+
+usage: python benchmarks/bench_memory.py [num-devices]
+"""
+import sys
+import os
+import gc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+import siptracklib
+import siptracklib.root
+
+def current_rss():
+    """Current resident set size in bytes."""
+    statm = open('/proc/self/statm').read().split()
+    return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def node_data(oid, parent, class_id, data, associations = []):
+    return {'oid': oid, 'parent': parent, 'class_id': class_id,
+            'data': data, 'associations': associations, 'references': [],
+            'ctime': 1300000000}
+
+def generate_tree(num_devices):
+    """Generate node data: devices with two attributes and a /32 network."""
+    yield node_data('1', '0', 'V', [])
+    yield node_data('2', '1', 'DT', [])
+    yield node_data('3', '1', 'NT', ['ipv4'])
+    oid = 10
+    for n in xrange(num_devices):
+        net_oid = str(oid + 3)
+        yield node_data(str(oid), '2', 'D', [], [net_oid])
+        yield node_data(str(oid + 1), str(oid), 'CA',
+                ['name', 'text', 'device-%d.example.com' % n])
+        yield node_data(str(oid + 2), str(oid), 'CA',
+                ['description', 'text', 'benchmark device'])
+        yield node_data(net_oid, '3', 'IP4N',
+                ['10.%d.%d.%d/32' % (n >> 16 & 255, n >> 8 & 255, n & 255)])
+        oid += 4
+
+def main():
+    num_devices = 50000
+    if len(sys.argv) > 1:
+        num_devices = int(sys.argv[1])
+    transport = siptracklib.transports['default']('localhost', 0, False)
+    object_store = siptracklib.root.ObjectStore(transport)
+    # Generate the node data up front so it isn't included in the count.
+    data = list(generate_tree(num_devices))
+    gc.collect()
+    before = current_rss()
+    object_store.loadChildren(data)
+    gc.collect()
+    after = current_rss()
+    num_nodes = len(object_store.oid_mapping) - 1
+    print 'nodes: %d' % (num_nodes)
+    print 'bytes per node: %d' % ((after - before) / num_nodes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Startup time of the siptrack command line client.
+
+Runs each command in a fresh interpreter and prints the median wall
+clock time of a number of runs. Commands that don't talk to a server
+(version, help) should start in well under 100ms.
+
+usage: python benchmarks/bench_startup.py [runs]
+"""
+import sys
+import os
+import time
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+siptrack = os.path.join(root, 'siptrack')
+
+commands = [
+    ('python -c pass', ['-c', 'pass']),
+    ('import siptracklib', ['-c', 'import siptracklib']),
+    ('import commands', ['-c', 'import siptracklib.basecommands']),
+    ('siptrack version', [siptrack, 'version']),
+    ('siptrack help', [siptrack, 'help']),
+]
+
+def run(args):
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    subprocess.call([sys.executable] + args, cwd = root,
+            stdout = devnull, stderr = devnull)
+    elapsed = time.time() - start
+    devnull.close()
+    return elapsed
+
+def timed(name, args, count):
+    times = sorted(run(args) for n in xrange(count))
+    median = times[len(times) // 2]
+    print '%-24s %8.1fms (min %.1fms)' % (name, median * 1000,
+            times[0] * 1000)
+
+def main():
+    count = 20
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    for name, args in commands:
+        timed(name, args, count)
+
+if __name__ == '__main__':
+    main()
@@ -15,14 +15,14 @@ from siptracklib.utils import (object_by_attribute, fetch_device_path)
 
 def connect(hostname, username = None, password = None, port = None,
         session_id = None, transport = 'default',
-        verify_session_id = False, use_ssl = True):
+        verify_session_id = False, use_ssl = True, pool_size = None):
     import siptracklib.root
     if port is None:
         if use_ssl:
             port = default_ssl_port
         else:
             port = default_port
-    t = transports[transport](hostname, port, use_ssl)
+    t = transports[transport](hostname, port, use_ssl, pool_size)
     t.connect(username, password, session_id, verify_session_id)
     object_store = siptracklib.root.ObjectStore(t)
     return object_store
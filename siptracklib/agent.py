@@ -0,0 +1,464 @@
+"""A local siptrack agent keeping a warm object store between commands.
+
+'siptrack agent start' logs in to the siptrack server and starts a
+background process listening on a UNIX socket (the agent-socket config
+option). While the agent is running the siptrack command line client
+forwards quick read-only lookups (commands with Command.agent set) to
+it, the agent runs them using its existing session and object store,
+with the clients stdin/stdout/stderr passed over the socket. Commands
+that need the users terminal (starting ssh etc.) hand that part back to
+the client, see Command.callLocal and local_functions.
+
+Nodes loaded by one command are reused by the following ones. The
+store isn't refreshed incrementally (the server has no way to list
+changes since a point in time), instead it's replaced with an empty one
+when it's older than agent-max-age seconds. Until then commands run by
+the agent can see nodes and attribute values that have since been
+changed or removed on the server, commands that need current data for
+the whole tree (json-dump-tree) are always run locally. Forwarding is
+off unless use-agent is enabled in the config file. The agent runs one
+command at a time.
+
+Messages in both directions are a one character message type followed
+by a length prefixed payload, see send_message/recv_message.
+"""
+import os
+import sys
+import socket
+import struct
+import time
+import errno
+import signal
+import getpass
+import traceback
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import siptracklib
+from siptracklib import errors
+from siptracklib import utils
+
+default_socket_filename = '~/.siptrack.agent'
+
+# Seconds before the agent replaces its object store.
+default_max_age = 300
+
+# The session is verified before running a command if the agent has
+# been idle for this many seconds.
+session_check_interval = 300
+
+# Output is sent to the client in chunks of (about) this size.
+output_buffer_size = 8192
+
+message_header = struct.Struct('!cI')
+
+# Client -> agent messages.
+msg_run = 'R'
+msg_input = 'I'
+msg_status = 'T'
+msg_stop = 'S'
+# Agent -> client messages.
+msg_stdout = 'O'
+msg_stderr = 'E'
+msg_readline = 'L'
+msg_read = 'A'
+msg_getpass = 'P'
+msg_not_handled = 'N'
+msg_exit = 'X'
+msg_reply = 'Y'
+
+# Functions commands run by the agent can have called in the client
+# process, see Command.callLocal. They're called as function(config, *args).
+local_functions = {
+        'connect-host': ('siptracklib.cmdconnect', 'connect_host'),
+        'copy-to-clipboard': ('siptracklib.cmdconnect', 'copy_to_clipboard'),
+        }
+
+def get_socket_filename(config):
+    filename = config.get('agent-socket') or default_socket_filename
+    return os.path.expanduser(filename)
+
+def send_message(sock, msg_type, payload = ''):
+    if type(payload) == unicode:
+        payload = payload.encode('utf-8')
+    sock.sendall(message_header.pack(msg_type, len(payload)) + payload)
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        data = sock.recv(min(size, 65536))
+        if not data:
+            raise errors.SiptrackError('lost connection to the siptrack agent')
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+def recv_message(sock):
+    """Return the next (message type, payload) received on sock."""
+    msg_type, size = message_header.unpack(
+            _recv_exactly(sock, message_header.size))
+    return msg_type, _recv_exactly(sock, size)
+
+def call_local_function(config, name, args):
+    if name not in local_functions:
+        raise errors.SiptrackError('unknown local function: %s' % (name))
+    module_name, function_name = local_functions[name]
+    module = __import__(module_name, fromlist = [function_name])
+    return getattr(module, function_name)(config, *args)
+
+def connect_agent(filename):
+    """Return a socket connected to the agent, None if it isn't running."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(filename)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+def forward_command(config, argv):
+    """Run a command (argv) in a running agent.
+
+    Returns the commands exit status, or None if no agent is running
+    or the agent doesn't run this command, it should then be run
+    locally.
+    """
+    if not config.getBool('use-agent', False):
+        return None
+    sock = connect_agent(get_socket_filename(config))
+    if sock is None:
+        return None
+    try:
+        send_message(sock, msg_run, json.dumps({'argv': argv,
+            'cwd': os.getcwd()}))
+        while True:
+            msg_type, payload = recv_message(sock)
+            if msg_type == msg_stdout:
+                sys.stdout.write(payload)
+            elif msg_type == msg_stderr:
+                sys.stderr.write(payload)
+            elif msg_type == msg_readline:
+                sys.stdout.flush()
+                send_message(sock, msg_input, sys.stdin.readline())
+            elif msg_type == msg_read:
+                sys.stdout.flush()
+                send_message(sock, msg_input, sys.stdin.read())
+            elif msg_type == msg_getpass:
+                sys.stdout.flush()
+                send_message(sock, msg_input, getpass.getpass(payload))
+            elif msg_type == msg_not_handled:
+                return None
+            elif msg_type == msg_exit:
+                result = json.loads(payload)
+                break
+            else:
+                raise errors.SiptrackError(
+                        'invalid message from the siptrack agent')
+    finally:
+        sock.close()
+    sys.stdout.flush()
+    for name, args in result['local_calls']:
+        call_local_function(config, name, args)
+    return result['status']
+
+def agent_request(config, msg_type):
+    """Send a status/stop request to the agent and return its reply."""
+    sock = connect_agent(get_socket_filename(config))
+    if sock is None:
+        raise errors.SiptrackError('no siptrack agent running')
+    try:
+        send_message(sock, msg_type)
+        reply_type, payload = recv_message(sock)
+    finally:
+        sock.close()
+    if reply_type != msg_reply:
+        raise errors.SiptrackError('invalid message from the siptrack agent')
+    return json.loads(payload)
+
+class AgentOutput(object):
+    """File-like object passing output to the agent client."""
+    def __init__(self, session, msg_type):
+        self.session = session
+        self.msg_type = msg_type
+        self.softspace = 0
+        self._buffer = []
+        self._size = 0
+
+    def write(self, data):
+        if type(data) == unicode:
+            data = data.encode(siptracklib.user_encoding, 'replace')
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= output_buffer_size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._size > 0:
+            data = ''.join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            send_message(self.session.sock, self.msg_type, data)
+
+    def isatty(self):
+        return False
+
+class AgentInput(object):
+    """File-like object reading from the agent clients stdin.
+
+    read() always reads until EOF.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def readline(self, size = -1):
+        return self.session.request(msg_readline)
+
+    def read(self, size = -1):
+        return self.session.request(msg_read)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def getpass(self, prompt):
+        """Prompt for a password in the client, see utils.read_password."""
+        return self.session.request(msg_getpass, prompt)
+
+    def isatty(self):
+        return False
+
+class AgentSession(object):
+    """A command run by the agent for a client.
+
+    Used as the ConnectionManager of the command, connect returns the
+    agents object store.
+    """
+    def __init__(self, agent, sock):
+        from siptracklib.config import SiptrackConfig
+        self.agent = agent
+        self.sock = sock
+        # Read the config files again, they might have changed.
+        self.config = SiptrackConfig(
+                options = dict(agent.config.options))
+        self.local_calls = []
+        self.stdin = AgentInput(self)
+        self.stdout = AgentOutput(self, msg_stdout)
+        self.stderr = AgentOutput(self, msg_stderr)
+
+    def connect(self):
+        return self.agent.getObjectStore()
+
+    def disconnect(self):
+        pass
+
+    def request(self, msg_type, payload = ''):
+        """Ask the client for input."""
+        self.stdout.flush()
+        self.stderr.flush()
+        send_message(self.sock, msg_type, payload)
+        reply_type, reply = recv_message(self.sock)
+        if reply_type != msg_input:
+            raise errors.SiptrackError('invalid message from agent client')
+        return reply
+
+    def run(self, argv, cwd):
+        """Run a command, argv is the command name and its arguments."""
+        from siptracklib import commands
+        command = None
+        if len(argv) > 0:
+            command = commands.get_command(argv[0])
+        if command is None or not command.agent:
+            send_message(self.sock, msg_not_handled)
+            return
+        saved_stdio = (sys.stdin, sys.stdout, sys.stderr,
+                utils.global_u_writer_fd)
+        saved_cwd = os.getcwd()
+        sys.stdin = self.stdin
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+        utils.global_u_writer_fd = utils.make_replace_printer()
+        status = 0
+        try:
+            os.chdir(cwd)
+            try:
+                commands.run_command(self, argv[0], argv[1:])
+            except errors.SiptrackError, e:
+                utils.cprint('ERROR: %s' % (e))
+                status = 1
+            except SystemExit, e:
+                status = e.code
+                if status is None:
+                    status = 0
+                elif type(status) != int:
+                    utils.cprint(status)
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            self.stdout.flush()
+            self.stderr.flush()
+        finally:
+            sys.stdin, sys.stdout, sys.stderr, utils.global_u_writer_fd = \
+                    saved_stdio
+            os.chdir(saved_cwd)
+        send_message(self.sock, msg_exit, json.dumps({'status': status,
+            'local_calls': self.local_calls}))
+
+class Agent(object):
+    """Serve siptrack commands on a UNIX socket using a warm object store.
+
+    cm is the ConnectionManager used to log in to the server.
+    """
+    def __init__(self, cm, socket_filename, max_age = default_max_age):
+        self.cm = cm
+        self.config = cm.config
+        self.socket_filename = socket_filename
+        self.max_age = max_age
+        self.transport = None
+        self.object_store = None
+        self.store_created = 0
+        self.last_used = 0
+        self.started = time.time()
+        self.commands = 0
+        self.sock = None
+        self.running = False
+
+    def connect(self):
+        """Log in to the server."""
+        self.object_store = self.cm.connect()
+        self.transport = self.object_store.transport
+        self.store_created = self.last_used = time.time()
+
+    def getObjectStore(self):
+        """Return the object store, replacing it if it's too old."""
+        from siptracklib import root
+        now = time.time()
+        if now - self.last_used > session_check_interval:
+            self._checkSession()
+        if self.object_store is None or now - self.store_created > self.max_age:
+            self.object_store = root.ObjectStore(self.transport)
+            self.store_created = now
+        self.last_used = now
+        return self.object_store
+
+    def _checkSession(self):
+        # hello returns 0 for invalid (expired) session ids.
+        if self.transport.cmd.hello() != 0:
+            return
+        try:
+            self.transport.reconnect()
+        except errors.InvalidLoginError:
+            raise errors.SiptrackError('the siptrack agent session has '
+                    'expired, restart the agent')
+        self.object_store = None
+
+    def listen(self):
+        check_not_running(self.socket_filename)
+        if os.path.exists(self.socket_filename):
+            os.unlink(self.socket_filename)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the current user may connect to the agent.
+        old_umask = os.umask(0077)
+        try:
+            self.sock.bind(self.socket_filename)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(16)
+
+    def serve(self):
+        """Handle clients until stopped."""
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    client, address = self.sock.accept()
+                except socket.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.handleClient(client)
+                except (socket.error, errors.SiptrackError):
+                    # The client went away.
+                    pass
+                finally:
+                    client.close()
+        finally:
+            self.close()
+
+    def handleClient(self, client):
+        msg_type, payload = recv_message(client)
+        if msg_type == msg_run:
+            request = json.loads(payload)
+            self.commands += 1
+            AgentSession(self, client).run(request['argv'], request['cwd'])
+        elif msg_type == msg_status:
+            send_message(client, msg_reply, json.dumps(self.status()))
+        elif msg_type == msg_stop:
+            self.running = False
+            send_message(client, msg_reply, json.dumps({}))
+
+    def status(self):
+        now = time.time()
+        nodes = 0
+        if self.object_store is not None:
+            nodes = len(self.object_store.oid_mapping) - 1
+        return {'pid': os.getpid(), 'socket': self.socket_filename,
+                'server': self.transport.hostname,
+                'username': self.transport.username,
+                'uptime': int(now - self.started),
+                'commands': self.commands,
+                'nodes': nodes,
+                'store_age': int(now - self.store_created)}
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.socket_filename):
+                os.unlink(self.socket_filename)
+        if self.transport is not None:
+            self.transport.disconnect()
+            self.transport = None
+
+def check_not_running(socket_filename):
+    sock = connect_agent(socket_filename)
+    if sock is not None:
+        sock.close()
+        raise errors.SiptrackError('a siptrack agent is already running '
+                '(%s)' % (socket_filename))
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+def start_agent(cm, foreground = False):
+    """Log in and run an agent, in the background unless foreground is set.
+
+    The agent logs in with a username and password rather than a
+    retained session, so it can log in again if its session expires.
+    """
+    config = cm.config
+    socket_filename = get_socket_filename(config)
+    check_not_running(socket_filename)
+    max_age = config.getInt('agent-max-age', default_max_age)
+    agent = Agent(cm, socket_filename, max_age)
+    config.set('retain-session', False)
+    agent.connect()
+    agent.listen()
+    utils.cprint('siptrack agent listening on %s' % (agent.socket_filename))
+    if not foreground:
+        sys.stdout.flush()
+        utils.daemonize()
+    signal.signal(signal.SIGTERM, _terminate)
+    agent.serve()
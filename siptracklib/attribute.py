@@ -4,18 +4,28 @@ from siptracklib.objectregistry import object_registry
 from siptracklib import treenodes
 from siptracklib import errors
 
+# Attribute names and types are repeated over and over again in a tree,
+# share a single string object for each of them.
+_interned_strings = {}
+
+def intern_string(string):
+    if string is None:
+        return None
+    return _interned_strings.setdefault(string, string)
+
 class AttributeBase(treenodes.BaseNode):
+    __slots__ = ('name', 'atype', '_value')
+    _valid_attributes = (
+        'attribute',
+        'versioned attribute',
+        'encrypted attribute'
+    )
 
     def __init__(self, parent, name = None, atype = None, value = None):
         super(AttributeBase, self).__init__(parent)
-        self._valid_attributes = [
-            'attribute',
-            'versioned attribute',
-            'encrypted attribute'
-        ]
-
-        self.name = name
-        self.atype = atype
+
+        self.name = intern_string(name)
+        self.atype = intern_string(atype)
         self._value = value
 
 
@@ -39,6 +49,34 @@ class AttributeBase(treenodes.BaseNode):
         return False
 
 
+    def sortKey(self):
+        return (self.name,)
+
+
+    def _loaded(self, node_data):
+        # A forced reload (ObjectStore.loadChildren(force = True)) can
+        # change the name and value of an attribute that's already in
+        # its parents attribute index.
+        reload = self.oid is not None
+        if reload:
+            self.parent._unindexAttribute(self)
+        super(AttributeBase, self)._loaded(node_data)
+        self._loadData(node_data['data'])
+        if reload:
+            self.parent._indexAttribute(self)
+            self._invalidateSortKey()
+            self._valueChanged()
+
+    def _loadData(self, data):
+        """Set the attribute name, type and value(s) from node data."""
+        raise NotImplementedError()
+
+    def _valueChanged(self):
+        """Called after the attribute value has been changed."""
+        if self.name is not None and self.name.lower() == 'name':
+            self.parent._invalidateSortKey()
+
+
     def describe(self):
         if self.atype in ['text', 'bool', 'int']:
             return '%s:%s:%s:%s:%s' % (self.class_name, self.oid, self.name,
@@ -76,6 +114,7 @@ class Attribute(AttributeBase):
             bool   : True/False
         value : a value matching the attributes type.
     """
+    __slots__ = ()
     class_id = 'CA'
     class_name = 'attribute'
     class_data_len = 3
@@ -93,11 +132,10 @@ class Attribute(AttributeBase):
         self.oid = self.transport.add(self.parent.oid, self.name,
                 self.atype, self.value)
 
-    def _loaded(self, node_data):
-        super(Attribute, self)._loaded(node_data)
-        self.name = node_data['data'][0]
-        self.atype = node_data['data'][1]
-        self._value = node_data['data'][2]
+    def _loadData(self, data):
+        self.name = intern_string(data[0])
+        self.atype = intern_string(data[1])
+        self._value = data[2]
 
     def _get_value(self):
         return self._value
@@ -105,6 +143,7 @@ class Attribute(AttributeBase):
     def _set_value(self, val):
         self._value = val
         self.transport.setValue(self.oid, val)
+        self._valueChanged()
     value = property(_get_value, _set_value)
 
     def _copySelf(self, target):
@@ -124,6 +163,7 @@ class VersionedAttribute(AttributeBase):
             bool   : True/False
         value : a value matching the attributes type.
     """
+    __slots__ = ('max_versions', 'values')
     class_id = 'VA'
     class_name = 'versioned attribute'
     class_data_len = 4
@@ -155,12 +195,11 @@ class VersionedAttribute(AttributeBase):
         self.oid = self.transport.add(self.parent.oid, self.name,
                 self.atype, self._value, self.max_versions)
 
-    def _loaded(self, node_data):
-        super(VersionedAttribute, self)._loaded(node_data)
-        self.name = node_data['data'][0]
-        self.atype = node_data['data'][1]
-        self.values = node_data['data'][2]
-        self.max_versions = node_data['data'][3]
+    def _loadData(self, data):
+        self.name = intern_string(data[0])
+        self.atype = intern_string(data[1])
+        self.values = data[2]
+        self.max_versions = data[3]
 
     def _get_value(self):
         return self.values[-1]
@@ -170,6 +209,7 @@ class VersionedAttribute(AttributeBase):
         self.values.append(val)
         if len(self.values) > self.max_versions:
             self.values.pop(0)
+        self._valueChanged()
     value = property(_get_value, _set_value)
 
     def _copySelf(self, target):
@@ -177,7 +217,7 @@ class VersionedAttribute(AttributeBase):
 
 
 class EncryptedAttribute(AttributeBase):
-
+    __slots__ = ()
     class_id = 'ENCA'
     class_name = 'encrypted attribute'
     class_data_len = 3
@@ -203,11 +243,10 @@ class EncryptedAttribute(AttributeBase):
         )
 
 
-    def _loaded(self, node_data):
-        super(EncryptedAttribute, self)._loaded(node_data)
-        self.name = node_data['data'][0]
-        self.atype = node_data['data'][1]
-        self._value = node_data['data'][2]
+    def _loadData(self, data):
+        self.name = intern_string(data[0])
+        self.atype = intern_string(data[1])
+        self._value = data[2]
 
 
     @property
@@ -218,6 +257,7 @@ class EncryptedAttribute(AttributeBase):
     def value(self, val):
         self._value = val
         self.transport.setValue(self.oid, val)
+        self._valueChanged()
 
     
     def _copySelf(self, target):
@@ -24,14 +24,12 @@ from __future__ import print_function
 
 import os
 import sys
-import subprocess
 
 import siptracklib
 from siptracklib.commands import Command, Option, Argument
 from siptracklib.errors import SiptrackError, SiptrackCommandError
 from siptracklib.utils import (cprint, read_password, object_by_attribute,
         fetch_device_path)
-from siptracklib import cmdconnect
 from siptracklib import utils
 from siptracklib import errors
 
@@ -77,6 +75,7 @@ class cmd_ping(Command):
 
     The returned value is a current local unix timestamp from the server.
     """
+    agent = True
 
     def run(self):
         cprint('Server said: %s' % (self.transport.cmd.ping()))
@@ -85,6 +84,7 @@ class cmd_ping(Command):
 
 class cmd_oid_type(Command):
     """Show what class type a node is."""
+    agent = True
     
     arguments = [
         Argument('oid', help = 'The id of node to move.'),
@@ -99,6 +99,7 @@ class cmd_oid_type(Command):
 
 class cmd_grep(Command):
     """Find devices."""
+    agent = True
     aliases = ['rgrep', 'search']
     arguments = [
         Argument('searchstring', help = 'Searchstring.'),
@@ -226,6 +227,7 @@ class cmd_grep(Command):
 
 class cmd_list_tree(Command):
     """Show the whole object tree."""
+    agent = True
     options = [
         Option('display-attributes', 'a', take_argument = False,
                 help = 'Display attributes.')
@@ -243,19 +245,38 @@ class cmd_list_tree(Command):
         return 0
 
 class cmd_json_dump_tree(Command):
-    """Dump a json representation of the whole object tree."""
+    """Dump a json representation of the whole object tree.
 
-    def run(self):
-        import json
-        self.view_tree.fetch(max_depth = -1)
-        data = []
-        for depth, node in self.view_tree.traverse(include_depth = True):
-            data.append(node.dictDescribe())
-        cprint(json.dumps(data, sort_keys=True, indent=4, separators=(',', ': ')))
+    Nodes are written as they are fetched. The json format is a single
+    json list, the jsonl format has one json object per line.
+    """
+    options = [
+        Option('format', 'f', take_argument = True,
+                help = 'Output format, json or jsonl (default: json).'),
+        Option('output', 'o', take_argument = True,
+                help = 'Write the dump to a file instead of stdout.'),
+        Option('gzip', 'z', take_argument = False,
+                help = 'Gzip compress the dump.'),
+        Option('sort-oids', 's', take_argument = False,
+                help = 'Sort nodes by oid, lets cmp-json-dumps compare the dump without sorting it (fetches the whole tree first).'),
+    ]
+
+    def run(self, format = 'json', output = None, gzip = False,
+            sort_oids = False):
+        from siptracklib import jsondump
+        jsondump.dump_tree(self.view_tree,
+                jsondump.open_output(output, gzip), format, sort_oids)
         return 0
 
 class cmd_cmp_json_dumps(Command):
-    """Compare two dumped json trees."""
+    """Compare two dumped json trees.
+
+    Reports nodes removed (only in file1), added (only in file2) and
+    changed (differing fields, attribute values are compared by hash).
+    Dumps sorted by oid (json-dump-tree --sort-oids) are compared one
+    node at a time, unsorted dumps are sorted in memory. jsonl and gzip
+    compressed dumps are supported.
+    """
 
     arguments = [
         Argument('file1',
@@ -265,30 +286,103 @@ class cmd_cmp_json_dumps(Command):
     ]
 
     def run(self, file1, file2):
-        import json
         import time
-        data_1 = json.loads(open(file1, 'r').read())
-        oids_1 = {}
-        for n in data_1:
-            oids_1[n['oid']] = n
-#        oids_1 = {n['oid']: n for n in data_1}
-        data_2 = json.loads(open(file2, 'r').read())
-        oids_2 = {}
-        for n in data_2:
-            oids_2[n['oid']] = n
-#        oids_2 = {n['oid']: n for n in data_2}
-        print(len(oids_1), len(oids_2))
-        for oid, node in oids_1.iteritems():
-            if oid not in oids_2:
-                print('IN 1', oid, node['cls'], time.ctime(node['ctime']))
-        for oid, node in oids_2.iteritems():
-            if oid not in oids_1:
-                print('IN 2', oid, node['cls'], time.ctime(node['ctime']))
+        from siptracklib import jsondump
+        changes, count_1, count_2 = jsondump.compare_dump_files(file1, file2)
+        counts = {'removed': 0, 'added': 0, 'changed': 0}
+        for change, node_1, node_2, fields in changes:
+            counts[change] += 1
+            if change == 'removed':
+                print('REMOVED %s %s %s' % (node_1['oid'], node_1['cls'],
+                    time.ctime(node_1['ctime'])))
+            elif change == 'added':
+                print('ADDED %s %s %s' % (node_2['oid'], node_2['cls'],
+                    time.ctime(node_2['ctime'])))
+            else:
+                print('CHANGED %s %s %s' % (node_2['oid'], node_2['cls'],
+                    ','.join(fields)))
+        print('nodes: %d %d, removed: %d, added: %d, changed: %d' % (
+            count_1, count_2, counts['removed'], counts['added'],
+            counts['changed']))
+        return 0
+
+class cmd_import_networks(Command):
+    """Import networks and ranges from a CSV or JSON file.
+
+    The file is validated locally and compared to the network tree,
+    only networks/ranges that don't exist yet are added (in batches).
+    CSV files have one network or range per row, optionally with a
+    header row naming a 'network' column and attribute columns. JSON
+    files contain a list of network strings or dicts with a 'network'
+    key.
+    """
+    arguments = [
+        Argument('filename', help = 'CSV or JSON file to import.'),
+    ]
+    options = [
+        Option('view', 'v', take_argument = True,
+                help = 'Name or oid of the view to import to (default: the first view).'),
+        Option('protocol', 'p', take_argument = True,
+                help = 'Network protocol, ipv4 or ipv6 (default: ipv4).'),
+        Option('format', 'f', take_argument = True,
+                help = 'Input format, csv or json (default: from the file extension).'),
+        Option('batch-size', 'b', take_argument = True,
+                help = 'Networks added per batch (default: 500).'),
+        Option('workers', 'w', take_argument = True,
+                help = 'Batches sent in parallel (default: 4).'),
+        Option('dry-run', 'n', take_argument = False,
+                help = 'Only show what would be imported.'),
+    ]
+
+    def _getView(self, view):
+        views = self.view_tree.listChildren(include = ['view'])
+        if view is None:
+            if len(views) == 0:
+                raise errors.SiptrackError('no views found')
+            return views[0]
+        for node in views:
+            if node.oid == view or node.attributes.get('name') == view:
+                return node
+        raise errors.SiptrackError('no such view: %s' % (view))
+
+    def _getNetworkTree(self, view, protocol):
+        trees = [tree for tree in view.listChildren(include = ['network tree'])
+                if tree.protocol == protocol]
+        if len(trees) == 0:
+            raise errors.SiptrackError('no %s network tree in view' % (
+                protocol))
+        for tree in trees:
+            if tree.attributes.get('name') == protocol:
+                return tree
+        return trees[0]
+
+    def run(self, filename, view = None, protocol = 'ipv4', format = None,
+            batch_size = None, workers = None, dry_run = False):
+        from siptracklib.network import bulkimport
+        if batch_size is None:
+            batch_size = bulkimport.default_batch_size
+        if workers is None:
+            workers = bulkimport.default_workers
+        entries = bulkimport.parse_file(filename, format)
+        network_tree = self._getNetworkTree(self._getView(view), protocol)
+        stats = bulkimport.import_networks(network_tree, entries,
+                int(batch_size), int(workers), dry_run)
+        for entry, error in stats.invalid:
+            cprint('invalid (line %s): %s' % (entry.line, error))
+        for entry, error in stats.failed:
+            cprint('failed: %s: %s' % (entry, error))
+        if dry_run:
+            cprint('dry run, would add: %d' % (stats.parsed -
+                len(stats.invalid) - stats.existing - stats.duplicates))
+        cprint(stats.summary())
+        if stats.invalid or stats.failed:
+            return 1
         return 0
 
 class cmd_connect(Command):
     """SSH/RDP connection to a device."""
     connected = True
+    agent = True
     arguments = [
         Argument('device',
             help = 'The device to connect to, can include an optional [username@].'),
@@ -305,8 +399,13 @@ class cmd_connect(Command):
     def run(self, device, search_all = False, console = False, regexp = False):
         if search_all:
             regexp = True
-        cmdconnect.cmd_connect(self.object_store,
-                device, search_all, not regexp, console, self.cm.config)
+        from siptracklib import cmdconnect
+        device, username, password, hostname = cmdconnect.resolve_connection(
+                self.object_store, device, search_all, not regexp,
+                self.cm.config)
+        # The connection is started by the client when run by an agent.
+        self.callLocal('connect-host', device.attributes.get('os'),
+                username, password, hostname, console)
 
         return 0
 
@@ -352,10 +451,60 @@ class cmd_connect_fork(Command):
     ]
 
     def run(self, username, hostname, pid, ssh):
+        from siptracklib import cmdconnect
         cmdconnect.cmd_connect_fork(username, hostname, pid, ssh)
 
         return 0
 
+class cmd_agent(Command):
+    """Run a siptrack agent keeping a warm object store.
+
+    start  - log in and start an agent in the background.
+    stop   - stop the running agent.
+    status - show the status of the running agent (default).
+
+    With use-agent = true in the config file, commands like grep, list
+    and connect are run by a running agent, reusing its session and
+    loaded objects, unless the server or username is given on the
+    command line. Loaded objects are kept for up to agent-max-age
+    seconds, so the agent can show data that has since been changed
+    on the server.
+    """
+    connected = False
+    arguments = [
+        Argument('action', optional = True,
+            help = 'start, stop or status.'),
+    ]
+    options = [
+        Option('foreground', 'f', take_argument = False,
+                help = 'Run the agent in the foreground (start).'),
+    ]
+
+    def run(self, action = 'status', foreground = False):
+        from siptracklib import agent
+        if action == 'start':
+            if not self.cm.config.getBool('use-agent', False):
+                cprint('note: use-agent is not enabled in the config file, '
+                        'commands will not be forwarded to the agent')
+            agent.start_agent(self.cm, foreground)
+        elif action == 'stop':
+            agent.agent_request(self.cm.config, agent.msg_stop)
+            cprint('siptrack agent stopped')
+        elif action == 'status':
+            status = agent.agent_request(self.cm.config, agent.msg_status)
+            cprint('pid: %s' % (status['pid']))
+            cprint('socket: %s' % (status['socket']))
+            cprint('server: %s' % (status['server']))
+            cprint('username: %s' % (status['username']))
+            cprint('uptime: %ss' % (status['uptime']))
+            cprint('commands run: %s' % (status['commands']))
+            cprint('nodes loaded: %s' % (status['nodes']))
+            cprint('object store age: %ss' % (status['store_age']))
+        else:
+            raise SiptrackCommandError('invalid agent action: %s' % (action))
+
+        return 0
+
 class cmd_edit_config(Command):
     """Open an editor for the siptrack config file."""
     connected = False
@@ -381,6 +530,7 @@ class cmd_edit_config(Command):
             print('No editor found.')
             return
         editorcmd = [editor, utils.get_user_config_file()]
+        import subprocess
         subprocess.Popen(editorcmd)
 
     def run(self):
@@ -419,6 +569,7 @@ class cmd_show_config_var(Command):
 class cmd_copy_password_clipboard(Command):
     """Copy a devices password to the clipboard."""
     connected = True
+    agent = True
     aliases = ['cc']
     arguments = [
         Argument('device',
@@ -434,14 +585,18 @@ class cmd_copy_password_clipboard(Command):
     def run(self, device, search_all = False, regexp = False):
         if search_all:
             regexp = True
-        cmdconnect.cmd_copy_password_clipboard(self.object_store,
-                device, search_all, not regexp, self.cm.config)
+        from siptracklib import cmdconnect
+        device, username, password = cmdconnect.resolve_device_password(
+                self.object_store, device, search_all, not regexp,
+                self.cm.config)
+        self.callLocal('copy-to-clipboard', password)
 
         return 0
 
 class cmd_get_device_config(Command):
     """Get a device configuration."""
     connected = True
+    agent = True
     aliases = []
     arguments = [
         Argument('device_name',
@@ -517,6 +672,7 @@ class cmd_submit_device_config(Command):
 
 class cmd_list(Command):
     """List devices."""
+    agent = True
 
     aliases = []
     arguments = [
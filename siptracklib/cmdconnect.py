@@ -11,6 +11,7 @@ import time
 import select
 
 from siptracklib import errors
+from siptracklib import treenodes
 from siptracklib import utils
 from siptracklib import win32utils
 
@@ -50,7 +51,11 @@ class BaseConnect(object):
         return True
 
     def connect(self, device, username, password, hostname):
-        host_os = device.attributes.get('os')
+        self.connectHost(device.attributes.get('os'), username, password,
+                hostname)
+
+    def connectHost(self, host_os, username, password, hostname):
+        """Connect to hostname, host_os is the devices os attribute."""
         if host_os == 'linux':
             print 'Trying ssh connection to %s@%s with password %s' % (username, hostname, password)
             self._connectSSH(hostname, username, password)
@@ -426,7 +431,7 @@ def get_device(st, hostname, search_all, quick_search):
         attr_limit = ['name']
     devices = utils.search_device(st, hostname,
             attr_limit, quick_search, max_results = 50)
-    devices.sort()
+    devices.sort(key = treenodes.sort_key)
     device = utils.select_device_from_list(devices)
     return device
 
@@ -502,26 +507,51 @@ def split_devicename(devicename):
     return username, hostname
 
 
-def cmd_connect(st, devicename, search_all, quick_search, console, config):
-    """Entry point for the connect command."""
+def resolve_device_password(st, devicename, search_all, quick_search, config):
+    """Find the device, username and password for a [username@]devicename."""
     config.sections = ['STCONNECT', 'DEFAULT']
     cmdline_username, hostname = split_devicename(devicename)
     device = get_device(st, hostname, search_all, quick_search)
     username, password = get_username_and_password(device, cmdline_username, config)
+    return device, username, password
+
+
+def resolve_connection(st, devicename, search_all, quick_search, config):
+    """Find the device, username, password and hostname to connect to."""
+    device, username, password = resolve_device_password(st, devicename,
+            search_all, quick_search, config)
     hostname_or_ip = select_device_hostname_or_ip(device, config)
+    return device, username, password, hostname_or_ip
+
+
+def connect_host(config, host_os, username, password, hostname, console):
+    """Start a ssh/rdp connection to hostname."""
+    config.sections = ['STCONNECT', 'DEFAULT']
     connection = get_connection_class(config)
     connection.rdp_console = console
-    connection.connect(device, username, password, hostname_or_ip)
+    connection.connectHost(host_os, username, password, hostname)
 
 
-def cmd_copy_password_clipboard(st, devicename, search_all, quick_search, config):
-    """Entry point for the copy_password_clipboard command."""
+def copy_to_clipboard(config, string):
+    """Copy a string to the local clipboard."""
     config.sections = ['STCONNECT', 'DEFAULT']
-    cmdline_username, hostname = split_devicename(devicename)
-    device = get_device(st, hostname, search_all, quick_search)
-    username, password = get_username_and_password(device, cmdline_username, config)
     connection = get_connection_class(config)
-    connection.addStringToClipboard(password)
+    connection.addStringToClipboard(string)
+
+
+def cmd_connect(st, devicename, search_all, quick_search, console, config):
+    """Entry point for the connect command."""
+    device, username, password, hostname_or_ip = resolve_connection(st,
+            devicename, search_all, quick_search, config)
+    connect_host(config, device.attributes.get('os'), username, password,
+            hostname_or_ip, console)
+
+
+def cmd_copy_password_clipboard(st, devicename, search_all, quick_search, config):
+    """Entry point for the copy_password_clipboard command."""
+    device, username, password = resolve_device_password(st, devicename,
+            search_all, quick_search, config)
+    copy_to_clipboard(config, password)
 
 
 def cmd_connect_fork(username, hostname, caller_pid, ssh_bin):
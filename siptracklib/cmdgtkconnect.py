@@ -16,6 +16,7 @@ import siptracklib.config
 import siptracklib.connections
 import siptracklib.cmdconnect
 import siptracklib.errors
+import siptracklib.treenodes
 from siptracklib import utils
 
 class AboutDialog(gtk.AboutDialog):
@@ -339,7 +340,7 @@ class STSearchScreen(object):
                     utils.search_device(self.st, search_text)
         except siptracklib.errors.SiptrackError:
             self._initSiptrack()
-        self._matched_devices.sort()
+        self._matched_devices.sort(key = siptracklib.treenodes.sort_key)
         self._updateDeviceSelection()
         if len(self._matched_devices) == 0:
             self.setStatus('no devices matched')
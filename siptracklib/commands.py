@@ -1,13 +1,7 @@
-from inspect import getdoc
-import socket
-
 import siptracklib
 from siptracklib.errors import SiptrackError, SiptrackCommandError
 from siptracklib.utils import cprint
 from siptracklib import utils
-from siptracklib import root
-from siptracklib import config
-from siptracklib import connections
 
 class Argument(object):
     """A class for describing command arguments.
@@ -129,6 +123,9 @@ class Command(object):
     options = []
     connected = True
     hidden = False
+    # Can be run by a siptrack agent, see siptracklib.agent. Only set for
+    # quick read-only lookups.
+    agent = False
 
     def __init__(self, cm = None):
         """Initialize a command object.
@@ -180,12 +177,27 @@ class Command(object):
         """Run the command itself, must be implemented in a subclass."""
         raise NotImplementedError()
 
+    def callLocal(self, name, *args):
+        """Call one of the agent.local_functions in the users process.
+
+        When the command is run by a siptrack agent the call is passed
+        back to the client and made once the command has finished,
+        otherwise it's made right away.
+        """
+        local_calls = getattr(self.cm, 'local_calls', None)
+        if local_calls is not None:
+            local_calls.append((name, args))
+        else:
+            from siptracklib import agent
+            agent.call_local_function(self.cm.config, name, args)
+
     def getName(self):
         """Return the command name."""
         return self.name
 
     def help(self):
         """Return the commands help text (docstring of the subclass)."""
+        from inspect import getdoc
         if self.__doc__ is Command.__doc__:
             return "No help available."
         return getdoc(self)
@@ -387,6 +399,13 @@ def run_siptrack(argv):
         opt = argv.pop(0)
         parse_option(opt, argv, global_options, optdict)
 
+    # A running agent is logged in to its own server, commands for other
+    # servers/users are always run locally.
+    use_agent = True
+    for option in ['server', 'username', 'password-file']:
+        if option in optdict:
+            use_agent = False
+
     if 'help' in optdict:
         from siptracklib.help import show_global_help
         show_global_help()
@@ -406,6 +425,13 @@ def run_siptrack(argv):
         show_global_help()
         return 1
 
+    command = get_command(argv[0])
+    if use_agent and command is not None and command.agent:
+        from siptracklib import agent
+        status = agent.forward_command(cm.config, argv)
+        if status is not None:
+            return status
+
     return run_command(cm, argv[0], argv[1:])
 
 def main(argv):
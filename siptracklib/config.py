@@ -1,4 +1,3 @@
-import ConfigParser
 import os
 import sys
 
@@ -11,22 +10,33 @@ default_options = {
         'session-filename': utils.get_default_session_filename(),
         'transport': 'default',
         'use-ssl': True,
-        'verbose': False
+        'verbose': False,
+        'use-agent': False,
+        'agent-socket': '~/.siptrack.agent',
         }
 
 class SiptrackConfig(object):
     def __init__(self, config_reader = None, sections = None,
             options = {}):
-        if config_reader:
-            self.config_reader = config_reader
-        else:
-            self.config_reader = ConfigReader(utils.get_default_config_files())
+        # The config files are read when first needed, see
+        # _getConfigReader.
+        self._config_reader = config_reader
         if sections:
             self.sections = sections
         else:
             self.sections = ['DEFAULT']
         self.options = options
 
+    def _getConfigReader(self):
+        if self._config_reader is None:
+            self._config_reader = ConfigReader(
+                    utils.get_default_config_files())
+        return self._config_reader
+
+    def _setConfigReader(self, config_reader):
+        self._config_reader = config_reader
+    config_reader = property(_getConfigReader, _setConfigReader)
+
     def get(self, option, default = None, sections = None):
         if sections is None:
             sections = self.sections
@@ -79,6 +89,7 @@ class ConfigReader(object):
     Parses a configuration file and has basic retrieval methods.
     """
     def __init__(self, config_files):
+        import ConfigParser
         self.conf = ConfigParser.SafeConfigParser()
         self.config_files = config_files
         self.conf.read(config_files)
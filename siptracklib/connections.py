@@ -1,7 +1,6 @@
 from __future__ import print_function
 
 import siptracklib
-import siptracklib.root
 import siptracklib.config
 from siptracklib import utils
 from siptracklib import errors
@@ -33,7 +32,11 @@ class ConnectionManager(object):
 
         self.transport = siptracklib.transports[self.config.get('transport')](
                 self._getServer(), self.config.getInt('port'),
-                self.config.getBool('use-ssl'))
+                self.config.getBool('use-ssl'),
+                self.config.getInt('connection-pool-size'))
+        if self.config.getInt('fetch-read-ahead') is not None:
+            self.transport.fetch_read_ahead = \
+                    self.config.getInt('fetch-read-ahead')
 
         connected = False
         if self.config.getBool('retain-session', False):
@@ -64,7 +67,9 @@ class ConnectionManager(object):
                 new_session_id
             )
 
-        object_store = siptracklib.root.ObjectStore(self.transport)
+        # Importing root loads (and registers) all node classes.
+        from siptracklib import root
+        object_store = root.ObjectStore(self.transport)
         return object_store
 
     def disconnect(self):
@@ -25,7 +25,7 @@ class DeviceTree(treenodes.BaseNode):
         if include_ranges:
             names += ['ipv4 network range', 'ipv6 network range']
         networks = self.listLinks(include=names)
-        networks.sort()
+        networks.sort(key = treenodes.sort_key)
         return networks
 
 class DeviceCategory(treenodes.BaseNode):
@@ -44,10 +44,11 @@ class DeviceCategory(treenodes.BaseNode):
         if include_ranges:
             names += ['ipv4 network range', 'ipv6 network range']
         networks = self.listLinks(include=names)
-        networks.sort()
+        networks.sort(key = treenodes.sort_key)
         return networks
 
 class Device(treenodes.BaseNode):
+    __slots__ = ()
     class_id = 'D'
     class_name = 'device'
     class_data_len = 0
@@ -72,14 +73,14 @@ class Device(treenodes.BaseNode):
         ipv4_networks = self.listLinks(include=names)
         if only_hosts:
             ipv4_networks = [n for n in ipv4_networks if n.isHost()]
-        ipv4_networks.sort()
+        ipv4_networks.sort(key = treenodes.sort_key)
         names = ['ipv6 network']
         if include_ranges:
             names += ['ipv6 network range']
         ipv6_networks = self.listLinks(include=names)
         if only_hosts:
             ipv6_networks = [n for n in ipv6_networks if n.isHost()]
-        ipv6_networks.sort()
+        ipv6_networks.sort(key = treenodes.sort_key)
         interface_networks = []
         if include_interfaces:
             interface_networks = self.listInterfaceNetworks(include_ranges,
@@ -124,7 +125,7 @@ def suggest_templates(base_node, target_class_id):
         template = base_node.root.getOID(oid)
         if template:
             templates.append(template)
-    templates.sort()
+    templates.sort(key = treenodes.sort_key)
     return templates
 
 class Template(treenodes.BaseNode):
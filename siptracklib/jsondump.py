@@ -0,0 +1,237 @@
+"""Streaming json dumps of the object tree.
+
+Nodes are written one at a time (their dictDescribe output) as they are
+fetched, rather than collecting the whole dump in memory first. Two
+formats are supported:
+
+json  - a single json list, the layout used by json-dump-tree.
+jsonl - json lines, one compact json object per node and line.
+
+Dumps can optionally be gzip compressed, open_input detects compressed
+dumps automatically.
+"""
+import sys
+import gzip
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from siptracklib import errors
+
+dump_formats = ['json', 'jsonl']
+
+gzip_magic = '\x1f\x8b'
+
+def oid_sort_key(oid):
+    """Sort key ordering oids numerically (for numeric oids)."""
+    oid = str(oid)
+    return (len(oid), oid)
+
+class DumpWriter(object):
+    """Write node dicts to a file object in one of the dump_formats."""
+    def __init__(self, fileobj, format = 'json'):
+        if format not in dump_formats:
+            raise errors.SiptrackError('invalid dump format: %s' % (format))
+        self.fileobj = fileobj
+        self.format = format
+        self.count = 0
+
+    def write(self, data):
+        if self.format == 'jsonl':
+            self.fileobj.write(json.dumps(data, sort_keys = True,
+                separators = (',', ':')))
+            self.fileobj.write('\n')
+        else:
+            text = json.dumps(data, sort_keys = True, indent = 4,
+                    separators = (',', ': '))
+            if self.count == 0:
+                self.fileobj.write('[\n    ')
+            else:
+                self.fileobj.write(',\n    ')
+            self.fileobj.write(text.replace('\n', '\n    '))
+        self.count += 1
+
+    def close(self):
+        if self.format == 'json':
+            if self.count == 0:
+                self.fileobj.write('[]\n')
+            else:
+                self.fileobj.write('\n]\n')
+        if self.fileobj is sys.stdout:
+            self.fileobj.flush()
+        else:
+            self.fileobj.close()
+
+def open_output(filename = None, compress = False):
+    """Open a dump output file, stdout if filename is None or '-'."""
+    if filename in [None, '-']:
+        if compress:
+            return gzip.GzipFile(fileobj = sys.stdout, mode = 'wb')
+        return sys.stdout
+    if compress:
+        return gzip.open(filename, 'wb')
+    return open(filename, 'wb')
+
+def open_input(filename):
+    """Open a (possibly gzip compressed) dump file for reading."""
+    fileobj = open(filename, 'rb')
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic == gzip_magic:
+        return gzip.GzipFile(fileobj = fileobj, mode = 'rb')
+    return fileobj
+
+def iter_fetch_nodes(view_tree):
+    """Fetch the whole tree, yielding nodes as they are loaded.
+
+    Nodes already loaded are yielded first, the remaining nodes as soon
+    as they have been received (see BaseNode.iterFetch), so a dump is
+    written while the tree is still being fetched.
+    """
+    for node in view_tree.traverse():
+        yield node
+    for node in view_tree.iterFetch(max_depth = -1):
+        yield node
+
+def iter_sorted_nodes(view_tree):
+    """Fetch the whole tree and yield all nodes sorted by oid."""
+    view_tree.fetch(max_depth = -1)
+    nodes = list(view_tree.traverse())
+    nodes.sort(key = lambda node: oid_sort_key(node.oid))
+    return iter(nodes)
+
+def dump_tree(view_tree, fileobj, format = 'json', sort_oids = False):
+    """Dump the whole tree to fileobj, returns the number of nodes.
+
+    If sort_oids is True the nodes are written sorted by oid (see
+    oid_sort_key), which needs the whole tree to be fetched first.
+    """
+    writer = DumpWriter(fileobj, format)
+    if sort_oids:
+        nodes = iter_sorted_nodes(view_tree)
+    else:
+        nodes = iter_fetch_nodes(view_tree)
+    for node in nodes:
+        writer.write(node.dictDescribe())
+    writer.close()
+    return writer.count
+
+def iter_dump(fileobj):
+    """Iterate over the node dicts in a json or jsonl dump.
+
+    jsonl dumps are read one line at a time, json list dumps have to be
+    decoded whole.
+    """
+    first = ''
+    while not first:
+        line = fileobj.readline()
+        if not line:
+            return
+        first = line.strip()
+    if first.startswith('['):
+        data = json.loads(line + fileobj.read())
+        for node in data:
+            yield node
+        return
+    yield json.loads(line)
+    for line in fileobj:
+        if line.strip():
+            yield json.loads(line)
+
+def _field_value(node, field):
+    value = node.get(field)
+    # Association/reference order isn't significant.
+    if field in ['associations', 'references'] and type(value) == list:
+        value = sorted(value)
+    return value
+
+def changed_fields(node_1, node_2):
+    """Return the sorted names of the dictDescribe fields that differ."""
+    fields = set(node_1) | set(node_2)
+    return sorted(field for field in fields
+            if _field_value(node_1, field) != _field_value(node_2, field))
+
+def compare_dumps(nodes_1, nodes_2):
+    """Compare two iterables of node dicts sorted by oid.
+
+    The dumps are merge joined on oid, so only one node from each dump
+    is kept in memory. Yields (change, node_1, node_2, fields) tuples,
+    change is one of:
+
+    removed - the node is only in the first dump (node_2 is None).
+    added   - the node is only in the second dump (node_1 is None).
+    changed - fields lists the dictDescribe fields that differ, attribute
+              values are compared by their hashes.
+    """
+    nodes_1 = iter(nodes_1)
+    nodes_2 = iter(nodes_2)
+    node_1 = next(nodes_1, None)
+    node_2 = next(nodes_2, None)
+    while node_1 is not None or node_2 is not None:
+        if node_2 is None:
+            cmp_key = -1
+        elif node_1 is None:
+            cmp_key = 1
+        else:
+            cmp_key = cmp(oid_sort_key(node_1['oid']),
+                    oid_sort_key(node_2['oid']))
+        if cmp_key < 0:
+            yield ('removed', node_1, None, None)
+            node_1 = next(nodes_1, None)
+        elif cmp_key > 0:
+            yield ('added', None, node_2, None)
+            node_2 = next(nodes_2, None)
+        else:
+            fields = changed_fields(node_1, node_2)
+            if fields:
+                yield ('changed', node_1, node_2, fields)
+            node_1 = next(nodes_1, None)
+            node_2 = next(nodes_2, None)
+
+class _UnsortedDump(Exception):
+    pass
+
+def _iter_checked(nodes, counter):
+    """Iterate over nodes, raising _UnsortedDump if not sorted by oid."""
+    prev = None
+    for node in nodes:
+        key = oid_sort_key(node['oid'])
+        if prev is not None and key <= prev:
+            raise _UnsortedDump()
+        prev = key
+        counter[0] += 1
+        yield node
+
+def _iter_counted(nodes, counter):
+    for node in nodes:
+        counter[0] += 1
+        yield node
+
+def _sorted_dump(filename):
+    nodes = list(iter_dump(open_input(filename)))
+    nodes.sort(key = lambda node: oid_sort_key(node['oid']))
+    return nodes
+
+def compare_dump_files(filename_1, filename_2):
+    """Compare two dump files, returns (changes, count_1, count_2).
+
+    changes is a list of compare_dumps tuples, count_1/count_2 the
+    number of nodes in each dump. The dumps are merge joined as they
+    are read, checking that they are sorted by oid (json-dump-tree
+    --sort-oids). If a dump turns out not to be sorted the comparison
+    is redone with both dumps sorted in memory.
+    """
+    count_1 = [0]
+    count_2 = [0]
+    try:
+        changes = list(compare_dumps(
+            _iter_checked(iter_dump(open_input(filename_1)), count_1),
+            _iter_checked(iter_dump(open_input(filename_2)), count_2)))
+    except _UnsortedDump:
+        count_1 = [0]
+        count_2 = [0]
+        changes = list(compare_dumps(
+            _iter_counted(_sorted_dump(filename_1), count_1),
+            _iter_counted(_sorted_dump(filename_2), count_2)))
+    return changes, count_1[0], count_2[0]
@@ -2,3 +2,8 @@ from siptracklib.network.tree import NetworkTree
 from siptracklib.network import tree
 from siptracklib.network import ipv4
 from siptracklib.network import ipv6
+from siptracklib.network import addressarray
+from siptracklib.network.addressarray import AddressArray
+from siptracklib.network import allocator
+from siptracklib.network.allocator import Allocator
+from siptracklib.network import bulkimport
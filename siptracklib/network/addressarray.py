@@ -0,0 +1,330 @@
+"""Bulk network address arrays.
+
+An AddressArray stores the start and end addresses of a set of networks
+as numpy integer arrays, so checks covering a whole network tree
+(containment, overlaps, free space) can be done with vectorized
+operations instead of one Address object at a time.
+
+Addresses are stored as two uint64 columns (high and low 64 bits) for
+both start and end. For ipv4 the high columns are always zero.
+
+numpy is an optional dependency, it's only needed if AddressArray is
+used.
+"""
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+from siptracklib.network import ipv4
+from siptracklib.network import ipv6
+from siptracklib import errors
+
+valid_protocols = ['ipv4', 'ipv6']
+
+low_mask = (1 << 64) - 1
+
+def _split(values):
+    """Split a list of (long) integers into high/low uint64 arrays."""
+    count = len(values)
+    high = numpy.fromiter((value >> 64 for value in values),
+            numpy.uint64, count)
+    low = numpy.fromiter((value & low_mask for value in values),
+            numpy.uint64, count)
+    return high, low
+
+def _join(high, low):
+    return (int(high) << 64) | int(low)
+
+def _less(a_high, a_low, b_high, b_low):
+    """Element-wise a < b for high/low encoded values."""
+    return (a_high < b_high) | ((a_high == b_high) & (a_low < b_low))
+
+def _less_equal(a_high, a_low, b_high, b_low):
+    return (a_high < b_high) | ((a_high == b_high) & (a_low <= b_low))
+
+def _inc(high, low):
+    """Add one to high/low encoded values (that aren't the max value)."""
+    low = low + numpy.uint64(1)
+    high = high + (low == 0).astype(numpy.uint64)
+    return high, low
+
+def _dec(high, low):
+    """Subtract one from high/low encoded values (that aren't zero)."""
+    high = high - (low == 0).astype(numpy.uint64)
+    low = low - numpy.uint64(1)
+    return high, low
+
+def _rank(*columns):
+    """Replace high/low encoded values with order preserving int64 ranks.
+
+    columns is a list of (high, low) pairs, all values in all pairs are
+    ranked together so the returned ranks can be compared with each
+    other. Equal values get equal ranks.
+    """
+    high = numpy.concatenate([column[0] for column in columns])
+    low = numpy.concatenate([column[1] for column in columns])
+    if not high.any():
+        ranks = low.astype(numpy.int64)
+        if len(low) == 0 or low.max() < (1 << 63):
+            return _unconcat(ranks, columns)
+    order = numpy.lexsort((low, high))
+    sorted_high = high[order]
+    sorted_low = low[order]
+    new_value = numpy.ones(len(order), dtype = numpy.int64)
+    if len(order) > 0:
+        new_value[0] = 0
+        new_value[1:] = (sorted_high[1:] != sorted_high[:-1]) | \
+                (sorted_low[1:] != sorted_low[:-1])
+    ranks = numpy.empty(len(order), dtype = numpy.int64)
+    ranks[order] = numpy.cumsum(new_value)
+    return _unconcat(ranks, columns)
+
+def _unconcat(values, columns):
+    ret = []
+    pos = 0
+    for column in columns:
+        ret.append(values[pos:pos + len(column[0])])
+        pos += len(column[0])
+    return ret
+
+def _address_bounds(protocol, address):
+    """Return (start, end) integers for an address.
+
+    address can be an address string, an Address object,
+    a Network node or an integer host address.
+    """
+    if hasattr(address, 'class_name'):
+        address = address.address
+    if type(address) in (int, long):
+        return address, address
+    if protocol == 'ipv4':
+        address = ipv4.address_from_string(address)
+    else:
+        address = ipv6.address_from_string(address)
+    return address.start, address.end
+
+class AddressArray(object):
+    """An array of address ranges (networks) for one protocol.
+
+    nodes is an optional list of objects (usually Network nodes)
+    matching the address ranges, it's kept in the same order when
+    sorting/filtering.
+    """
+    def __init__(self, protocol, start_high, start_low, end_high, end_low,
+            nodes = None):
+        if not has_numpy:
+            raise errors.SiptrackError('numpy is required for address arrays')
+        if protocol not in valid_protocols:
+            raise errors.SiptrackError('invalid protocol: %s' % (protocol))
+        self.protocol = protocol
+        self.start_high = start_high
+        self.start_low = start_low
+        self.end_high = end_high
+        self.end_low = end_low
+        self.nodes = nodes
+        self._ranks = None
+
+    @classmethod
+    def fromRanges(cls, protocol, ranges, nodes = None):
+        """Build an array from a list of (start, end) integers."""
+        if not has_numpy:
+            raise errors.SiptrackError('numpy is required for address arrays')
+        start_high, start_low = _split([start for start, end in ranges])
+        end_high, end_low = _split([end for start, end in ranges])
+        return cls(protocol, start_high, start_low, end_high, end_low,
+                nodes)
+
+    @classmethod
+    def fromNetworks(cls, protocol, networks):
+        """Build an array from a list of ipv4/ipv6 Network nodes."""
+        networks = list(networks)
+        ranges = [_address_bounds(protocol, network.address)
+                for network in networks]
+        return cls.fromRanges(protocol, ranges, networks)
+
+    @classmethod
+    def fromNetworkTree(cls, network_tree):
+        """Build an array of all loaded networks in a network tree."""
+        protocol = network_tree.protocol
+        return cls.fromNetworks(protocol, network_tree.traverse(
+            include_self = False, include = ['%s network' % (protocol)]))
+
+    def __len__(self):
+        return len(self.start_low)
+
+    def __repr__(self):
+        return '<AddressArray(%s, %d)>' % (self.protocol, len(self))
+
+    def _getRanks(self):
+        if self._ranks is None:
+            self._ranks = _rank((self.start_high, self.start_low),
+                    (self.end_high, self.end_low))
+        return self._ranks
+
+    def take(self, indices):
+        """Return a new array with the entries at indices (or a mask)."""
+        indices = numpy.asarray(indices)
+        if indices.dtype == bool:
+            indices = numpy.flatnonzero(indices)
+        nodes = None
+        if self.nodes is not None:
+            nodes = [self.nodes[i] for i in indices]
+        return AddressArray(self.protocol, self.start_high[indices],
+                self.start_low[indices], self.end_high[indices],
+                self.end_low[indices], nodes)
+
+    def sortOrder(self):
+        """Indices sorting by start address, supernets before subnets."""
+        if len(self) == 0:
+            return numpy.zeros(0, dtype = numpy.intp)
+        start_ranks, end_ranks = self._getRanks()
+        span = int(end_ranks.max()) + 1
+        if (int(start_ranks.max()) + 1) * span <= (1 << 64):
+            # Sorting a single combined key is a lot faster than lexsort.
+            span = numpy.uint64(span)
+            key = start_ranks.astype(numpy.uint64) * span + \
+                    (span - numpy.uint64(1) - end_ranks.astype(numpy.uint64))
+            return numpy.argsort(key, kind = 'mergesort')
+        return numpy.lexsort((-end_ranks, start_ranks))
+
+    def sort(self):
+        """Return a sorted copy of the array, see sortOrder."""
+        return self.take(self.sortOrder())
+
+    def iterRanges(self):
+        """Iterate over (start, end) integer tuples."""
+        for i in xrange(len(self)):
+            yield (_join(self.start_high[i], self.start_low[i]),
+                    _join(self.end_high[i], self.end_low[i]))
+
+    def contains(self, address):
+        """Return a mask of the entries that contain address."""
+        start_high, start_low, end_high, end_low = self._bounds(address)
+        return _less_equal(self.start_high, self.start_low,
+                start_high, start_low) & \
+                _less_equal(end_high, end_low, self.end_high, self.end_low)
+
+    def within(self, address):
+        """Return a mask of the entries contained in address."""
+        start_high, start_low, end_high, end_low = self._bounds(address)
+        return _less_equal(start_high, start_low,
+                self.start_high, self.start_low) & \
+                _less_equal(self.end_high, self.end_low, end_high, end_low)
+
+    def _bounds(self, address):
+        start, end = _address_bounds(self.protocol, address)
+        return (numpy.uint64(start >> 64), numpy.uint64(start & low_mask),
+                numpy.uint64(end >> 64), numpy.uint64(end & low_mask))
+
+    def _groups(self):
+        """Merge the entries into disjoint groups.
+
+        Returns the sort order, a mask of entries (in sort order) that
+        start a new group and the rank of the highest end address
+        seen so far for each entry (in sort order).
+        """
+        start_ranks, end_ranks = self._getRanks()
+        order = self.sortOrder()
+        start_ranks = start_ranks[order]
+        max_end = numpy.maximum.accumulate(end_ranks[order])
+        new_group = numpy.ones(len(order), dtype = bool)
+        new_group[1:] = start_ranks[1:] > max_end[:-1]
+        return order, new_group, max_end
+
+    def overlaps(self):
+        """Return a mask of the entries overlapping some other entry.
+
+        Nested networks (and duplicates) count as overlapping, so this
+        is normally used on an array of sibling networks.
+        """
+        if len(self) == 0:
+            return numpy.zeros(0, dtype = bool)
+        order, new_group, max_end = self._groups()
+        # An entry overlaps if it isn't alone in its group.
+        group_ids = numpy.cumsum(new_group)
+        group_sizes = numpy.bincount(group_ids)
+        mask = numpy.empty(len(order), dtype = bool)
+        mask[order] = group_sizes[group_ids] > 1
+        return mask
+
+    def containsAddresses(self, addresses):
+        """Return a mask of the addresses covered by any entry.
+
+        addresses is another AddressArray, only its start addresses
+        are checked.
+        """
+        if len(self) == 0:
+            return numpy.zeros(len(addresses), dtype = bool)
+        order, new_group, max_end = self._groups()
+        start_ranks, end_ranks, points = _rank(
+                (self.start_high, self.start_low),
+                (self.end_high, self.end_low),
+                (addresses.start_high, addresses.start_low))
+        group_starts = start_ranks[order][new_group]
+        group_ends = numpy.maximum.accumulate(
+                end_ranks[order])[numpy.append(new_group[1:], True)]
+        pos = numpy.searchsorted(group_starts, points, 'right') - 1
+        found = pos >= 0
+        pos[~found] = 0
+        return found & (points <= group_ends[pos])
+
+    def freeSpace(self, address):
+        """Return the unallocated ranges of address.
+
+        Entries outside address are ignored. The free ranges are
+        returned as a new (sorted) AddressArray without nodes.
+        """
+        start_high, start_low, end_high, end_low = self._bounds(address)
+        inside = self.take(self.within(address))
+        if len(inside) == 0:
+            return AddressArray(self.protocol,
+                    numpy.array([start_high]), numpy.array([start_low]),
+                    numpy.array([end_high]), numpy.array([end_low]))
+        order, new_group, max_end = inside._groups()
+        first_index = order[new_group]
+        end_index = _group_max_end(inside, order, new_group)
+        g_start_high = inside.start_high[first_index]
+        g_start_low = inside.start_low[first_index]
+        g_end_high = inside.end_high[end_index]
+        g_end_low = inside.end_low[end_index]
+        # Gaps between groups, a group ends before the next one starts.
+        gap_start_high, gap_start_low = _inc(g_end_high[:-1], g_end_low[:-1])
+        gap_end_high, gap_end_low = _dec(g_start_high[1:], g_start_low[1:])
+        valid = _less_equal(gap_start_high, gap_start_low,
+                gap_end_high, gap_end_low)
+        ranges_start_high = [gap_start_high[valid]]
+        ranges_start_low = [gap_start_low[valid]]
+        ranges_end_high = [gap_end_high[valid]]
+        ranges_end_low = [gap_end_low[valid]]
+        # Before the first group.
+        if _less(start_high, start_low, g_start_high[0], g_start_low[0]):
+            high, low = _dec(g_start_high[:1], g_start_low[:1])
+            ranges_start_high.insert(0, numpy.array([start_high]))
+            ranges_start_low.insert(0, numpy.array([start_low]))
+            ranges_end_high.insert(0, high)
+            ranges_end_low.insert(0, low)
+        # After the last group.
+        if _less(g_end_high[-1], g_end_low[-1], end_high, end_low):
+            high, low = _inc(g_end_high[-1:], g_end_low[-1:])
+            ranges_start_high.append(high)
+            ranges_start_low.append(low)
+            ranges_end_high.append(numpy.array([end_high]))
+            ranges_end_low.append(numpy.array([end_low]))
+        return AddressArray(self.protocol,
+                numpy.concatenate(ranges_start_high).astype(numpy.uint64),
+                numpy.concatenate(ranges_start_low).astype(numpy.uint64),
+                numpy.concatenate(ranges_end_high).astype(numpy.uint64),
+                numpy.concatenate(ranges_end_low).astype(numpy.uint64))
+
+def _group_max_end(array, order, new_group):
+    """Return the index of the entry with the highest end in each group."""
+    start_ranks, end_ranks = array._getRanks()
+    group_ids = numpy.cumsum(new_group) - 1
+    sorted_end_ranks = end_ranks[order]
+    # Sort by group, then end rank, the last entry of each group wins.
+    by_end = numpy.lexsort((sorted_end_ranks, group_ids))
+    group_last = numpy.append(group_ids[by_end][1:] != \
+            group_ids[by_end][:-1], True)
+    return order[by_end[group_last]]
@@ -0,0 +1,251 @@
+"""Client side allocation of free addresses in networks.
+
+An Allocator keeps the free address intervals of a loaded ipv4 or ipv6
+network and picks free hosts or subnets from them locally, without a
+server round trip per allocation. Allocated blocks are reserved in the
+allocator until commit() adds them all to the network in a single
+batched request.
+
+    allocator = Allocator(network)
+    hosts = allocator.allocateHosts(40)
+    subnet = allocator.allocateNetwork(26)
+    networks = allocator.commit()
+
+The free space is computed from the networks children when the
+allocator is created, networks added by other clients after that are
+only noticed when the batched add fails (AlreadyExists etc.).
+"""
+import bisect
+
+from siptracklib import errors
+from siptracklib.network import ipv4
+from siptracklib.network import ipv6
+
+protocol_modules = {
+        'IP4N': (ipv4, 32),
+        'IP6N': (ipv6, 128),
+        }
+
+class Allocator(object):
+    """Free address allocator for an ipv4.Network or ipv6.Network.
+
+    The free space is kept as a sorted list of non-overlapping
+    (start, end) address intervals. Child networks are allocated space,
+    if avoid_ranges is True child network ranges are treated as
+    allocated as well.
+    """
+    def __init__(self, network, avoid_ranges = True):
+        if network.class_id not in protocol_modules:
+            raise errors.SiptrackError(
+                    'unable to allocate addresses in %s' % (network.class_name))
+        self.network = network
+        self.avoid_ranges = avoid_ranges
+        self.protocol, self.address_bits = protocol_modules[network.class_id]
+        self.pending = []
+        self._starts = []
+        self._ends = []
+        self.reset()
+
+    def __repr__(self):
+        return '<Allocator(%s)>' % (self.network.address)
+
+    def reset(self):
+        """Drop pending allocations and recalculate the free space."""
+        self.pending = []
+        used = []
+        include = [self.network.class_name]
+        if self.avoid_ranges:
+            include.append('%s range' % (self.network.class_name))
+        for child in self.network.listChildren(include = include,
+                sorted = False):
+            if child.class_id == self.network.class_id:
+                used.append((child.address.start, child.address.end))
+            else:
+                used.append((child.range.start, child.range.end))
+        used.sort()
+        self._starts = []
+        self._ends = []
+        pos = self.network.address.start
+        for start, end in used:
+            if start > pos:
+                self._starts.append(pos)
+                self._ends.append(start - 1)
+            pos = max(pos, end + 1)
+        if pos <= self.network.address.end:
+            self._starts.append(pos)
+            self._ends.append(self.network.address.end)
+
+    def listFree(self):
+        """Return the free address intervals as (start, end) tuples."""
+        return zip(self._starts, self._ends)
+
+    def numFree(self):
+        """Return the number of free addresses."""
+        return sum(end - start + 1
+                for start, end in zip(self._starts, self._ends))
+
+    def isFree(self, address):
+        """Check if all of address (an Address or string) is free."""
+        address = self.protocol.address_from_string(address)
+        pos = bisect.bisect_right(self._starts, address.start) - 1
+        return pos >= 0 and self._ends[pos] >= address.end
+
+    def _reservedHosts(self):
+        """Addresses never handed out as hosts.
+
+        The network and broadcast addresses of ipv4 networks larger
+        than a /31.
+        """
+        address = self.network.address
+        if self.protocol is ipv4 and address.end - address.start > 1:
+            return (address.start, address.end)
+        return ()
+
+    def _reserve(self, start, end):
+        """Remove start-end, which must be free, from the free space."""
+        pos = bisect.bisect_right(self._starts, start) - 1
+        free_start = self._starts[pos]
+        free_end = self._ends[pos]
+        del self._starts[pos]
+        del self._ends[pos]
+        if end < free_end:
+            self._starts.insert(pos, end + 1)
+            self._ends.insert(pos, free_end)
+        if start > free_start:
+            self._starts.insert(pos, free_start)
+            self._ends.insert(pos, start - 1)
+
+    def _makeAddress(self, start, bits):
+        return self.protocol.Address(start,
+                self.protocol.bitcount_netmasks[bits],
+                mask = False, validate = False)
+
+    def allocateHosts(self, count):
+        """Allocate the count lowest free host addresses.
+
+        Returns a list of host Address objects (/32 or /128). Nothing
+        is allocated if there aren't count free hosts.
+        """
+        reserved = self._reservedHosts()
+        hosts = []
+        for start, end in zip(self._starts, self._ends):
+            host = start
+            while host <= end and len(hosts) < count:
+                if host not in reserved:
+                    hosts.append(host)
+                host += 1
+            if len(hosts) == count:
+                break
+        if len(hosts) < count:
+            raise errors.SiptrackError(
+                    'not enough free hosts in %s, %d requested, %d free' % (
+                        self.network.address, count, len(hosts)))
+        addresses = []
+        for host in hosts:
+            self._reserve(host, host)
+            addresses.append(self._makeAddress(host, self.address_bits))
+        self.pending.extend(addresses)
+        return addresses
+
+    def allocateHost(self):
+        """Allocate the lowest free host address."""
+        return self.allocateHosts(1)[0]
+
+    def allocateNetwork(self, bits):
+        """Allocate the lowest free subnet with prefix length bits.
+
+        Returns an Address object, eg. allocateNetwork(26) returns the
+        first free /26.
+        """
+        bits = int(bits)
+        if bits < self.network.address.numToBitcount(
+                self.network.address.netmask) or bits > self.address_bits:
+            raise errors.SiptrackError('invalid prefix length for %s: %s' % (
+                self.network.address, bits))
+        size = 1 << (self.address_bits - bits)
+        for start, end in zip(self._starts, self._ends):
+            # Round up to the first address aligned to the block size.
+            block_start = (start + size - 1) & ~(size - 1)
+            if block_start + size - 1 <= end:
+                self._reserve(block_start, block_start + size - 1)
+                address = self._makeAddress(block_start, bits)
+                self.pending.append(address)
+                return address
+        raise errors.SiptrackError('no free /%d in %s' % (bits,
+            self.network.address))
+
+    def allocateNetworks(self, bits, count):
+        """Allocate count subnets with prefix length bits."""
+        allocated = []
+        try:
+            for n in range(count):
+                allocated.append(self.allocateNetwork(bits))
+        except errors.SiptrackError:
+            for address in allocated:
+                self.release(address)
+            raise
+        return allocated
+
+    def release(self, address):
+        """Return a pending (uncommitted) allocation to the free space."""
+        self.pending.remove(address)
+        start = address.start
+        end = address.end
+        pos = bisect.bisect_left(self._starts, start)
+        # Merge with adjacent free intervals.
+        if pos < len(self._starts) and self._starts[pos] == end + 1:
+            end = self._ends[pos]
+            del self._starts[pos]
+            del self._ends[pos]
+        if pos > 0 and self._ends[pos - 1] == start - 1:
+            self._ends[pos - 1] = end
+        else:
+            self._starts.insert(pos, start)
+            self._ends.insert(pos, end)
+
+    def commit(self):
+        """Add all pending allocations to the network.
+
+        The networks are added with a single batched request and the
+        new network nodes are returned. If some of the adds fail the
+        networks that were added are still created locally and the
+        first error is raised. When called inside an outer batch the
+        outer batch is flushed as well (the new oids are needed right
+        away), errors of the adds are still raised here.
+        """
+        pending = self.pending
+        self.pending = []
+        if len(pending) == 0:
+            return []
+        network = self.network
+        section = network.transport_root.section(network.class_id)
+        results = []
+        networks = []
+        try:
+            with network.transport_root.batch() as batch:
+                for address in pending:
+                    results.append(section.add(network.oid,
+                        address.transportable()))
+                # Flush explicitly in case we're part of an outer batch,
+                # the oids are needed right away.
+                batch.flush()
+        finally:
+            for address, result in zip(pending, results):
+                if result.done() and not result.failed():
+                    networks.append(self._loadNetwork(address,
+                        result.result()))
+        # A nested batch doesn't raise errors on exit, check the results.
+        for result in results:
+            if result.failed():
+                result.result()
+        return networks
+
+    def _loadNetwork(self, address, oid):
+        node_data = {'oid': oid, 'parent': self.network.oid,
+                'class_id': self.network.class_id,
+                'data': [address.transportable()],
+                'associations': [], 'references': [], 'ctime': 0}
+        node = self.network.loadChild(node_data)
+        # A new network has no children.
+        node.fetched_children = True
+        return node
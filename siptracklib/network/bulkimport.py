@@ -0,0 +1,328 @@
+"""Bulk import of networks and network ranges into a network tree.
+
+Input is parsed and validated locally, compared to the networks already
+in the tree and only the missing networks/ranges are added, using
+batched (system.multicall) adds sent from a few threads in parallel.
+
+    entries = bulkimport.parse_csv(open('networks.csv'))
+    stats = bulkimport.import_networks(network_tree, entries)
+    print stats.summary()
+
+CSV input has one network (nn.nn.nn.nn/mm) or range (start end) per
+row. If the first row doesn't start with a valid network it's used as
+a header, the column named 'network' (or the first column) holds the
+network and the other columns are set as text attributes on the new
+networks, eg.
+
+    network,description
+    10.0.0.0/24,office lan
+
+JSON input is a list of network strings or of dicts with a 'network'
+key, other keys are set as text attributes.
+"""
+import csv
+import time
+import threading
+import Queue
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from siptracklib import errors
+
+default_batch_size = 500
+default_workers = 4
+
+network_class_ids = {'ipv4': 'IP4N', 'ipv6': 'IP6N'}
+range_class_ids = {'ipv4': 'IP4NR', 'ipv6': 'IP6NR'}
+
+class ImportEntry(object):
+    """A network or range to import."""
+    __slots__ = ('line', 'string', 'attributes', 'value', 'is_range')
+
+    def __init__(self, line, string, attributes = None):
+        self.line = line
+        self.string = string.strip()
+        self.attributes = attributes or {}
+        # Parsed Address/Range object, see validate.
+        self.value = None
+        self.is_range = False
+
+    def __repr__(self):
+        return '<ImportEntry(%s:%s)>' % (self.line, self.string)
+
+    def validate(self, network_tree):
+        """Parse the entry string with the network trees protocol."""
+        if network_tree.isValidAddress(self.string):
+            self.value = network_tree.address(self.string)
+        elif network_tree.isValidRange(self.string):
+            self.value = network_tree.range(self.string)
+            self.is_range = True
+        else:
+            raise errors.SiptrackError('invalid address/range string: %s' % (
+                self.string))
+
+    def key(self):
+        return (self.is_range, self.value.transportable())
+
+class ImportStats(object):
+    """Counters from a bulk import."""
+    def __init__(self):
+        self.parsed = 0
+        self.invalid = []
+        self.duplicates = 0
+        self.existing = 0
+        self.added = 0
+        self.attributes = 0
+        self.failed = []
+        self.elapsed = 0.0
+
+    def rate(self):
+        """Added networks/ranges per second."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.added / self.elapsed
+
+    def summary(self):
+        lines = [
+                'parsed: %d' % (self.parsed),
+                'invalid: %d' % (len(self.invalid)),
+                'duplicates: %d' % (self.duplicates),
+                'existing: %d' % (self.existing),
+                'added: %d' % (self.added),
+                'attributes set: %d' % (self.attributes),
+                'failed: %d' % (len(self.failed)),
+                'time: %.2fs (%.1f networks/s)' % (self.elapsed, self.rate()),
+                ]
+        return '\n'.join(lines)
+
+def _make_entry(line, row, header):
+    if header is None:
+        return ImportEntry(line, row[0])
+    network = None
+    attributes = {}
+    for name, value in zip(header, row):
+        if name == 'network':
+            network = value
+        elif value.strip():
+            attributes[name] = value.strip()
+    return ImportEntry(line, network or '', attributes)
+
+def parse_csv(fileobj):
+    """Return ImportEntry objects for the rows of a CSV file."""
+    entries = []
+    header = None
+    for line, row in enumerate(csv.reader(fileobj), 1):
+        if len(row) == 0 or not row[0].strip() or \
+                row[0].strip().startswith('#'):
+            continue
+        if line == 1 and not _looks_like_network(row[0]):
+            header = [name.strip().lower() for name in row]
+            if 'network' not in header:
+                header[0] = 'network'
+            continue
+        entries.append(_make_entry(line, row, header))
+    return entries
+
+def _looks_like_network(string):
+    string = string.strip()
+    return len(string) > 0 and (string[0].isdigit() or ':' in string)
+
+def parse_json(fileobj):
+    """Return ImportEntry objects from a JSON list of networks."""
+    try:
+        data = json.load(fileobj)
+    except ValueError, e:
+        raise errors.SiptrackError('invalid json input: %s' % (e))
+    if type(data) != list:
+        raise errors.SiptrackError('invalid json input: expected a list')
+    entries = []
+    for line, item in enumerate(data, 1):
+        if isinstance(item, basestring):
+            entries.append(ImportEntry(line, item))
+        elif type(item) == dict and 'network' in item:
+            attributes = dict((name, unicode(value))
+                    for name, value in item.iteritems() if name != 'network')
+            entries.append(ImportEntry(line, item['network'], attributes))
+        else:
+            entries.append(ImportEntry(line, unicode(item)))
+    return entries
+
+def parse_file(filename, format = None):
+    """Parse a CSV or JSON file, format defaults to the file extension."""
+    if format is None:
+        if filename.lower().endswith('.json'):
+            format = 'json'
+        else:
+            format = 'csv'
+    if format == 'json':
+        return parse_json(open(filename, 'r'))
+    elif format == 'csv':
+        return parse_csv(open(filename, 'rb'))
+    raise errors.SiptrackError('unknown import format: %s' % (format))
+
+def _existing_keys(network_tree):
+    keys = set()
+    protocol = network_tree.protocol
+    for node in network_tree.traverse(include_self = False,
+            include = ['%s network' % (protocol),
+                '%s network range' % (protocol)]):
+        if node.class_name.endswith('range'):
+            keys.add((True, node.range.transportable()))
+        else:
+            keys.add((False, node.address.transportable()))
+    return keys
+
+def send_batched(transport, calls, batch_size = default_batch_size,
+        workers = default_workers):
+    """Send (rpc method, args) calls in batches from worker threads.
+
+    Calls are split in batches of batch_size commands, each sent as a
+    single multicall request, with up to workers batches in flight at
+    once. Returns a list of multicall.BatchResult objects matching
+    calls, if a whole batch fails its results hold the batch error.
+    """
+    import xmlrpclib
+    results = [None] * len(calls)
+    chunks = Queue.Queue()
+    for offset in range(0, len(calls), batch_size):
+        chunks.put(offset)
+
+    def send_chunks():
+        while True:
+            try:
+                offset = chunks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                with transport.batch(batch_size):
+                    for pos in range(offset,
+                            min(offset + batch_size, len(calls))):
+                        method, args = calls[pos]
+                        results[pos] = method(*args)
+            except (errors.SiptrackError, xmlrpclib.Error, IOError):
+                # Failed commands are flagged in their results.
+                pass
+
+    threads = [threading.Thread(target = send_chunks)
+            for n in range(min(workers, chunks.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def _result_oid(result):
+    if result is None or not result.done() or result.failed():
+        return None
+    return result.result()
+
+def _result_error(result):
+    if result is None or not result.done():
+        return 'not sent'
+    try:
+        result.result()
+    except Exception, e:
+        return str(e)
+    return None
+
+def import_networks(network_tree, entries, batch_size = default_batch_size,
+        workers = default_workers, dry_run = False, fetch = True):
+    """Add the entries missing from network_tree.
+
+    entries are ImportEntry objects, see parse_csv/parse_json. The
+    network tree is fetched (unless fetch is False) and compared to
+    the entries, networks and ranges that don't exist yet are added
+    with send_batched, followed by their attributes. If anything was
+    added the network tree is fetched again afterwards, since the
+    server places new networks under their supernets. Returns an
+    ImportStats object, invalid entries and failed adds are listed as
+    (entry, error) tuples in stats.invalid and stats.failed.
+    """
+    stats = ImportStats()
+    start = time.time()
+    valid = []
+    for entry in entries:
+        stats.parsed += 1
+        try:
+            entry.validate(network_tree)
+        except errors.SiptrackError, e:
+            stats.invalid.append((entry, str(e)))
+            continue
+        valid.append(entry)
+
+    if fetch:
+        network_tree.fetch(max_depth = -1, include_associations = False,
+                include_references = False)
+    existing = _existing_keys(network_tree)
+    missing = []
+    seen = set()
+    for entry in valid:
+        key = entry.key()
+        if key in existing:
+            stats.existing += 1
+        elif key in seen:
+            stats.duplicates += 1
+        else:
+            seen.add(key)
+            missing.append(entry)
+    # Add supernets before their subnets.
+    missing.sort(key = lambda entry: (entry.value.start, -entry.value.end))
+    if dry_run:
+        stats.elapsed = time.time() - start
+        return stats
+
+    transport_root = network_tree.transport_root
+    network_section = transport_root.section(
+            network_class_ids[network_tree.protocol])
+    range_section = transport_root.section(
+            range_class_ids[network_tree.protocol])
+    calls = []
+    for entry in missing:
+        section = network_section
+        if entry.is_range:
+            section = range_section
+        calls.append((section.add,
+            (network_tree.oid, entry.value.transportable())))
+    results = send_batched(transport_root, calls, batch_size, workers)
+
+    added = []
+    for entry, result in zip(missing, results):
+        oid = _result_oid(result)
+        if oid is None:
+            stats.failed.append((entry, _result_error(result)))
+            continue
+        added.append((entry, oid))
+    stats.added = len(added)
+
+    attribute_section = transport_root.section('CA')
+    calls = []
+    attributes = []
+    for entry, oid in added:
+        for name, value in sorted(entry.attributes.iteritems()):
+            calls.append((attribute_section.add, (oid, name, 'text', value)))
+            attributes.append(entry)
+    results = send_batched(transport_root, calls, batch_size, workers)
+    for entry, result in zip(attributes, results):
+        if _result_oid(result) is None:
+            stats.failed.append((entry, _result_error(result)))
+            continue
+        stats.attributes += 1
+    if added:
+        _refetch_tree(network_tree)
+    stats.elapsed = time.time() - start
+    return stats
+
+def _refetch_tree(network_tree):
+    """Reload network_tree from the server after networks were added.
+
+    The server nests new networks under their supernets and moves
+    existing subnets under new supernets, so the loaded tree is dropped
+    and fetched again rather than patched locally.
+    """
+    for child in list(network_tree.children):
+        child._purge()
+    network_tree.fetched_children = False
+    network_tree.fetch(max_depth = -1, include_associations = False,
+            include_references = False)
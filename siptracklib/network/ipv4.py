@@ -1,5 +1,6 @@
 import socket
 import struct
+import bisect
 
 from siptracklib.objectregistry import object_registry
 from siptracklib import treenodes
@@ -9,6 +10,18 @@ from siptracklib import confignode
 from siptracklib import permission
 from siptracklib import errors
 
+# Precompiled struct for converting between packed addresses and integers.
+address_struct = struct.Struct('>L')
+
+# Prefix length -> netmask and netmask -> prefix length lookup tables.
+bitcount_netmasks = [(0xffffffffL << (32 - bits)) & 0xffffffffL
+        for bits in range(33)]
+netmask_bitcounts = dict((netmask, bits)
+        for bits, netmask in enumerate(bitcount_netmasks))
+# Prefix length string ('24') -> netmask, for parsing cidr strings.
+bitcount_string_netmasks = dict((str(bits), netmask)
+        for bits, netmask in enumerate(bitcount_netmasks))
+
 def dotted_quad_to_num(network):
     """Convert a 'dotted quad' string to an unsigned integer.
 
@@ -16,7 +29,7 @@ def dotted_quad_to_num(network):
     The number is returned in host byte order.
     """
     try:
-        return long(struct.unpack('>L',socket.inet_aton(network))[0])
+        return long(address_struct.unpack(socket.inet_aton(network))[0])
     except socket.error, e:
         raise errors.SiptrackError('%s' % e)
 
@@ -26,11 +39,37 @@ def bitcount_to_num(netmask):
     ie. convert a '/24' netmask count to an integer.
     The returned value is in host byte order.
     """
+    if 0 <= netmask <= 32:
+        return bitcount_netmasks[netmask]
     res = 0L
     for n in range(netmask):
         res |= 1<<31 - n
     return res
 
+def num_to_dotted_quad(network):
+    """Convert an unsigned integer into a 'dotted quad' string.
+
+    NUM -> '192.168.1.1'
+    The number must be given in host byte order.
+    """
+    return socket.inet_ntoa(address_struct.pack(network))
+
+def num_to_bitcount(netmask):
+    """Count the number of bits set in a netmask number.
+
+    The number must be given in host byte order.
+    No validation is done to verify that the given value is a real
+    netmask.
+    """
+    bits = netmask_bitcounts.get(netmask)
+    if bits is None:
+        bits = bin(netmask).count('1')
+    return bits
+
+def is_valid_netmask(netmask):
+    """Check that a netmask number is a contiguous block of set bits."""
+    return netmask in netmask_bitcounts
+
 def dotted_quad_cidr_to_num(network):
     """Convert the network string a.b.c.d/nn to network, netmask integers.
 
@@ -43,23 +82,27 @@ def dotted_quad_cidr_to_num(network):
         return (None, None)
 
     try:
-        network = dotted_quad_to_num(network)
-    except errors.SiptrackError:
-        return (None, None)
-
-    try:
-        netmask = int(netmask)
-    except ValueError:
-        return (None, None)
-    if netmask < 0 or netmask > 32:
+        network = address_struct.unpack(socket.inet_aton(network))[0]
+    except socket.error:
         return (None, None)
 
-    netmask = bitcount_to_num(netmask)
+    mask = bitcount_string_netmasks.get(netmask)
+    if mask is None:
+        try:
+            netmask = int(netmask)
+        except ValueError:
+            return (None, None)
+        if netmask < 0 or netmask > 32:
+            return (None, None)
+        mask = bitcount_netmasks[netmask]
+    netmask = mask
     network = network & netmask
 
     return (network, netmask)
 
 class Address(object):
+    __slots__ = ('address', 'netmask', 'network', 'start', 'broadcast', 'end')
+
     def __init__(self, address, netmask, mask = True, validate = True):
         self.address = address
         self.netmask = netmask
@@ -126,16 +169,7 @@ class Address(object):
             return True
         return False
 
-    def _isValidNetmask(self, netmask):
-        foundzero = False
-        for n in range(32):
-            pos = 31 - n
-            val = (netmask >> pos) & 1
-            if val == 0:
-                foundzero = True
-            if val == 1 and foundzero is True:
-                return False
-        return True
+    _isValidNetmask = staticmethod(is_valid_netmask)
 
     def inc(self, step = 1):
         addr = self.clone()
@@ -171,13 +205,7 @@ class Address(object):
             return '%s/%s' % (self.numToDottedQuad(self.address),
                     self.numToBitcount(self.netmask))
 
-    def numToDottedQuad(self, network):
-        """Convert an unsigned integer into a 'dotted quad' string.
-
-        NUM -> '192.168.1.1'
-        The number must be given in host byte order.
-        """
-        return socket.inet_ntoa(struct.pack('>L', network))
+    numToDottedQuad = staticmethod(num_to_dotted_quad)
 
     def host(self):
         """Return a string of Address.address/32."""
@@ -192,20 +220,10 @@ class Address(object):
     def strNetmaskCIDR(self):
         return str(self.numToBitcount(self.netmask))
 
-    def numToBitcount(self, netmask):
-        """Count the number of bits set in a netmask number.
-    
-        The number must be given in host byte order.
-        No validation is done to verify that the given value is a real
-        netmask.
-        """
-        bits = 0
-        for n in range(32):
-            if ((netmask >> n) & 1) == 1:
-                bits += 1
-        return bits
+    numToBitcount = staticmethod(num_to_bitcount)
 
 class Network(treenodes.BaseNode):
+    __slots__ = ('address',)
     class_id = 'IP4N'
     class_name = 'ipv4 network'
     class_data_len = 1
@@ -244,6 +262,9 @@ class Network(treenodes.BaseNode):
             return True
         return False
 
+    def sortKey(self):
+        return (self.address.address,)
+
     def describe(self):
         return '%s:%s:%s' % (self.class_name, self.oid, self.address)
 
@@ -260,10 +281,40 @@ class Network(treenodes.BaseNode):
         # self.address string so that /32 is added if necessary.
         self.oid = self.transport.add(self.parent.oid,
                 self.address.transportable())
+        self._index()
 
     def _loaded(self, node_data):
+        self._unindex()
         super(Network, self)._loaded(node_data)
         self.address = self.addressFromString(node_data['data'][0])
+        self._index()
+
+    def _delete(self):
+        self._unindex()
+        super(Network, self)._delete()
+
+    def relocate(self, new_parent):
+        self._unindex()
+        super(Network, self).relocate(new_parent)
+        self._index()
+
+    def _getNetworkIndex(self):
+        tree = self.getNetworkTree()
+        if tree is None:
+            return None
+        return tree._network_index
+
+    def _index(self):
+        index = self._getNetworkIndex()
+        if index is not None:
+            index.add(self)
+
+    def _unindex(self):
+        if self.address is None:
+            return
+        index = self._getNetworkIndex()
+        if index is not None:
+            index.remove(self)
 
     def addressFromString(self, address):
         return address_from_string(address)
@@ -273,7 +324,7 @@ class Network(treenodes.BaseNode):
             children = self.listChildren(include = ['ipv4 network'])
             missing = self.findMissingNetworks()
             all = list(children) + list(missing)
-            all.sort()
+            all.sort(key = treenodes.sort_key)
             return iter(all)
         else:
             return self.listChildren(include = ['ipv4 network'])
@@ -339,6 +390,10 @@ class Network(treenodes.BaseNode):
         
         The list consist of UnallocatedNetwork objects.
         """
+        if self.fetched_children:
+            return find_missing_networks(self.address.start,
+                    self.address.end, self.listChildren(fetch = False,
+                        include = ['ipv4 network'], sorted = False))
         missing = self.transport.findMissingNetworks(self.oid)
         return parse_missing_networks_list(missing)
 
@@ -375,6 +430,9 @@ class UnallocatedNetwork(object):
             return True
         return False
 
+    def sortKey(self):
+        return (self.address.address,)
+
     def describe(self):
         return '%s:%s' % (self.class_name, self.oid, self.address)
 
@@ -470,13 +528,7 @@ class Range(object):
     def printableEnd(self):
         return self.numToDottedQuad(self.end)
     
-    def numToDottedQuad(self, network):
-        """Convert an unsigned integer into a 'dotted quad' string.
-
-        NUM -> '192.168.1.1'
-        The number must be given in host byte order.
-        """
-        return socket.inet_ntoa(struct.pack('>L', network))
+    numToDottedQuad = staticmethod(num_to_dotted_quad)
 
 class NetworkRange(treenodes.BaseNode):
     class_id = 'IP4NR'
@@ -515,6 +567,9 @@ class NetworkRange(treenodes.BaseNode):
             return True
         return False
 
+    def sortKey(self):
+        return (self.range.start,)
+
     def describe(self):
         return '%s:%s:%s' % (self.class_name, self.oid, self.address)
 
@@ -567,12 +622,150 @@ class NetworkRange(treenodes.BaseNode):
         self.range = val
     address = property(_get_address, _set_address)
 
+class NetworkIndex(object):
+    """An in-memory index of the ipv4 networks in a network tree.
+
+    Networks are stored in one dict per prefix length, so longest
+    prefix matches need at most one dict lookup per prefix length in
+    use and no server queries. A list of networks sorted by start
+    address, used for subnet listings, is built when first needed.
+
+    Only networks loaded in the local object store are indexed, see
+    NetworkTree.networkIndex.
+    """
+    def __init__(self, networks = []):
+        # prefix length -> {network address: Network}
+        self._prefixes = {}
+        # Prefix lengths in use, longest first.
+        self._prefix_lengths = []
+        self._sorted = None
+        self._sorted_starts = None
+        for network in networks:
+            self.add(network)
+
+    def __len__(self):
+        return sum(len(networks) for networks in self._prefixes.itervalues())
+
+    def add(self, network):
+        bits = netmask_bitcounts[network.address.netmask]
+        networks = self._prefixes.get(bits)
+        if networks is None:
+            networks = self._prefixes[bits] = {}
+            self._prefix_lengths = sorted(self._prefixes, reverse = True)
+        networks[network.address.start] = network
+        self._sorted = None
+
+    def remove(self, network):
+        bits = netmask_bitcounts[network.address.netmask]
+        networks = self._prefixes.get(bits)
+        if networks is None or \
+                networks.get(network.address.start) is not network:
+            return
+        del networks[network.address.start]
+        if not networks:
+            del self._prefixes[bits]
+            self._prefix_lengths = sorted(self._prefixes, reverse = True)
+        self._sorted = None
+
+    def get(self, address):
+        """Return the network matching address exactly, or None."""
+        address = _index_address(address)
+        networks = self._prefixes.get(
+                netmask_bitcounts[address.netmask])
+        if networks is None:
+            return None
+        return networks.get(address.start)
+
+    def longestMatch(self, address):
+        """Return the most specific network containing address, or None.
+
+        address can be an Address, an address string or an integer
+        host address. For network addresses the network itself is
+        returned if it exists.
+        """
+        if type(address) in (int, long):
+            start = address
+            max_bits = 32
+        else:
+            address = _index_address(address)
+            start = address.start
+            max_bits = netmask_bitcounts[address.netmask]
+        prefixes = self._prefixes
+        for bits in self._prefix_lengths:
+            if bits > max_bits:
+                continue
+            network = prefixes[bits].get(start & bitcount_netmasks[bits])
+            if network is not None:
+                return network
+        return None
+
+    def isAllocated(self, address):
+        """Check if address is part of any indexed network."""
+        return self.longestMatch(address) is not None
+
+    def _getSorted(self):
+        if self._sorted is None:
+            entries = []
+            for bits, networks in self._prefixes.iteritems():
+                for start, network in networks.iteritems():
+                    entries.append((start, bits, network))
+            entries.sort(key = lambda entry: entry[:2])
+            self._sorted = [entry[2] for entry in entries]
+            self._sorted_starts = [entry[0] for entry in entries]
+        return self._sorted, self._sorted_starts
+
+    def listSubnets(self, address, include_self = False):
+        """Return all indexed subnets of address, sorted by address.
+
+        Subnets of subnets are included, supernets are listed before
+        their subnets.
+        """
+        address = _index_address(address)
+        networks, starts = self._getSorted()
+        ret = []
+        pos = bisect.bisect_left(starts, address.start)
+        while pos < len(starts) and starts[pos] <= address.end:
+            network = networks[pos]
+            if network.address.end <= address.end:
+                if include_self or \
+                        network.address.netmask != address.netmask:
+                    ret.append(network)
+            pos += 1
+        return ret
+
 def parse_missing_networks_list(missing):
     for addr_string in missing:
         address = address_from_string(addr_string)
         network = UnallocatedNetwork(address)
         yield network
 
+def range_to_addresses(start, end):
+    """Split the address range start-end into the largest cidr blocks."""
+    while start <= end:
+        host_bits = (end - start + 1).bit_length() - 1
+        if start:
+            host_bits = min(host_bits, (start & -start).bit_length() - 1)
+        yield Address(start, bitcount_netmasks[32 - host_bits],
+                mask = False, validate = False)
+        start += 1 << host_bits
+
+def find_missing_networks(start, end, networks):
+    """Return the unallocated subnets of the address range start-end.
+
+    networks are the allocated networks (in any order), the gaps
+    between them are returned as a list of UnallocatedNetwork objects.
+    """
+    missing = []
+    pos = start
+    for network in sorted(networks, key = lambda n: n.address.start):
+        if network.address.start > pos:
+            missing.extend(UnallocatedNetwork(address) for address in
+                    range_to_addresses(pos, network.address.start - 1))
+        pos = max(pos, network.address.end + 1)
+    missing.extend(UnallocatedNetwork(address) for address in
+            range_to_addresses(pos, end))
+    return missing
+
 def is_valid_address_string(address):
     try:
         a = address_from_string(address)
@@ -603,6 +796,11 @@ def address_from_string(address, mask = True, validate = True):
         raise errors.SiptrackError('invalid address string: network/netmask is None')
     return Address(network, netmask, mask, validate)
 
+def _index_address(address):
+    if type(address) in (int, long):
+        return Address(address, 0xffffffff, mask = False, validate = False)
+    return address_from_string(address)
+
 def is_valid_range_string(range):
     try:
         a = range_from_string(range)
@@ -10,6 +10,225 @@ from siptracklib import permission
 from siptracklib import errors
 from siptracklib.external import ipaddr
 
+all_ones = (1 << 128) - 1
+
+# Precompiled struct for converting between packed addresses and integers.
+address_struct = struct.Struct('>QQ')
+
+# Prefix length -> netmask and netmask -> prefix length lookup tables.
+bitcount_netmasks = [(all_ones << (128 - bits)) & all_ones
+        for bits in range(129)]
+netmask_bitcounts = dict((netmask, bits)
+        for bits, netmask in enumerate(bitcount_netmasks))
+# Prefix length string ('64') -> netmask, for parsing cidr strings.
+bitcount_string_netmasks = dict((str(bits), netmask)
+        for bits, netmask in enumerate(bitcount_netmasks))
+
+# socket.inet_pton/inet_ntop aren't available on all platforms.
+has_inet_pton = hasattr(socket, 'inet_pton') and \
+        hasattr(socket, 'inet_ntop')
+
+def string_to_num(address):
+    """Convert an ipv6 address string to an unsigned integer.
+
+    '2001:db8::1' -> NUM
+    """
+    if has_inet_pton:
+        try:
+            high, low = address_struct.unpack(
+                    socket.inet_pton(socket.AF_INET6, address))
+        except (socket.error, UnicodeError):
+            raise errors.SiptrackError('invalid ipv6 address: %s' % (address))
+        return (high << 64) | low
+    try:
+        return int(ipaddr.IPv6Address(address))
+    except ValueError:
+        raise errors.SiptrackError('invalid ipv6 address: %s' % (address))
+
+def num_to_string(number):
+    """Convert an unsigned integer to a (compressed) ipv6 address string.
+
+    NUM -> '2001:db8::1'
+    """
+    if has_inet_pton:
+        address = socket.inet_ntop(socket.AF_INET6,
+                address_struct.pack(number >> 64, number & 0xffffffffffffffff))
+        # ipv4 mapped/compatible addresses are printed with a dotted
+        # quad suffix, stick to hex for those.
+        if '.' not in address:
+            return address
+    return str(ipaddr.IPv6Address(number))
+
+def num_to_exploded(number):
+    """Convert an unsigned integer to a full (exploded) ipv6 address string.
+
+    NUM -> '2001:0db8:0000:0000:0000:0000:0000:0001'
+    """
+    digits = '%032x' % (number)
+    return ':'.join([digits[pos:pos + 4] for pos in range(0, 32, 4)])
+
+def num_to_reverse_pointer(number):
+    """Return the ip6.arpa nibble reverse name for an address number."""
+    digits = list('%032x' % (number))
+    digits.reverse()
+    return '%s.ip6.arpa' % ('.'.join(digits))
+
+def bitcount_to_num(netmask):
+    """Return an unsigned integer with 'netmask' bits set."""
+    return bitcount_netmasks[netmask]
+
+def num_to_bitcount(netmask):
+    """Count the number of bits set in a netmask number.
+
+    No validation is done to verify that the given value is a real
+    netmask.
+    """
+    bits = netmask_bitcounts.get(netmask)
+    if bits is None:
+        bits = bin(netmask).count('1')
+    return bits
+
+def is_valid_netmask(netmask):
+    """Check that a netmask number is a contiguous block of set bits."""
+    return netmask in netmask_bitcounts
+
+class Address(object):
+    """An ipv6 address/network.
+
+    Works like ipv4.Address, address, netmask, network (start) and
+    broadcast (end) are 128 bit integers.
+    """
+    __slots__ = ('address', 'netmask', 'network', 'start', 'broadcast', 'end')
+
+    def __init__(self, address, netmask, mask = True, validate = True):
+        self.address = address
+        self.netmask = netmask
+        self._calcAddrData()
+
+        if mask:
+            self.address = self.network
+
+        if validate:
+            if not self._isValidNetmask(netmask):
+                raise ValueError('invalid netmask')
+
+    def clone(self):
+        return Address(self.address, self.netmask, mask = False,
+                validate = False)
+
+    def _calcAddrData(self):
+        self.network = self.address & self.netmask
+        self.start = self.network
+        self.broadcast = self.network + (all_ones - self.netmask)
+        self.end = self.broadcast
+
+    def __repr__(self):
+        return '<IPV6.Address(%s, %s)>' % (self.address, self.netmask)
+
+    def __str__(self):
+        return self.printableCIDR()
+
+    def __lt__(self, other):
+        """True if the current address is a subnet of 'other'."""
+        if self.start >= other.start and self.end <= other.end:
+            if self.start > other.start or self.end < other.end:
+                return True
+        return False
+
+    def __le__(self, other):
+        """True if the current address is a subnet of, or equal to, 'other'."""
+        if self.start >= other.start and self.end <= other.end:
+            return True
+        return False
+
+    def __eq__(self, other):
+        """True if the addresses are identical."""
+        if self.start == other.start and self.end == other.end:
+            return True
+        return False
+
+    def __ne__(self, other):
+        """True if the address are not identical."""
+        if self.start != other.start or self.end != other.end:
+            return True
+        return False
+
+    def __gt__(self, other):
+        """True if the current address is a supernet of 'other'."""
+        if other.start >= self.start and other.end <= self.end:
+            if other.start > self.start or other.end < self.end:
+                return True
+        return False
+
+    def __ge__(self, other):
+        """True if the current address is a supernet of, or equal to, 'other'."""
+        if other.start >= self.start and other.end <= self.end:
+            return True
+        return False
+
+    _isValidNetmask = staticmethod(is_valid_netmask)
+
+    def inc(self, step = 1):
+        addr = self.clone()
+        addr.address += step
+        addr._calcAddrData()
+        return addr
+
+    def dec(self, step = 1):
+        addr = self.clone()
+        addr.address -= step
+        addr._calcAddrData()
+        return addr
+
+    def isHigher(self, other):
+        if self.address > other.address:
+            return True
+        return False
+
+    def printableCIDR(self):
+        return '%s/%s' % (num_to_string(self.address),
+                self.numToBitcount(self.netmask))
+    printable = printableCIDR
+    transportable = printableCIDR
+
+    def printablePretty(self):
+        if self.netmask == all_ones:
+            return num_to_string(self.address)
+        return self.printableCIDR()
+
+    def host(self):
+        """Return a string of Address.address/128."""
+        return '%s/128' % (num_to_string(self.address))
+
+    def strAddress(self):
+        return num_to_string(self.address)
+
+    def strNetmask(self):
+        return num_to_string(self.netmask)
+
+    def strNetmaskCIDR(self):
+        return str(self.numToBitcount(self.netmask))
+
+    def reversePointer(self):
+        """Return the ip6.arpa name of the address."""
+        return num_to_reverse_pointer(self.address)
+
+    numToBitcount = staticmethod(num_to_bitcount)
+
+    # Compatibility with the ipaddr.IPNetwork objects previously used
+    # for ipv6 addresses.
+    def _get_exploded(self):
+        return num_to_exploded(self.address)
+    exploded = property(_get_exploded)
+
+    def _get_prefixlen(self):
+        return self.numToBitcount(self.netmask)
+    prefixlen = property(_get_prefixlen)
+
+    def _get_numhosts(self):
+        return self.end - self.start + 1
+    numhosts = property(_get_numhosts)
+
 class Network(treenodes.BaseNode):
     class_id = 'IP6N'
     class_name = 'ipv6 network'
@@ -36,7 +255,7 @@ class Network(treenodes.BaseNode):
                 isinstance(other, UnallocatedNetwork)) or \
                 not other.class_name in ['ipv6 network', 'ipv6 network unallocated']:
             return super(Network, self).__lt__(other)
-        if self.address < other.address:
+        if self.sortKey() < other.sortKey():
             return True
         return False
 
@@ -49,6 +268,9 @@ class Network(treenodes.BaseNode):
             return True
         return False
 
+    def sortKey(self):
+        return (self.address.start, self.address.netmask)
+
     def describe(self):
         return '%s:%s:%s' % (self.class_name, self.oid, self.address)
 
@@ -60,25 +282,26 @@ class Network(treenodes.BaseNode):
     def _created(self):
         if self.address is None:
             raise errors.SiptrackError('invalid address in network object')
-        self.address = ipaddr.IPNetwork(self.address, version=6, mask_address=True)
+        self.address = self.addressFromString(self.address)
         # Use self.address.printableCIDR() rather then the (original)
-        # self.address string so that /32 is added if necessary.
+        # self.address string so that /128 is added if necessary.
         self.oid = self.transport.add(self.parent.oid,
-                str(self.address))
+                self.address.transportable())
 
     def _loaded(self, node_data):
         super(Network, self)._loaded(node_data)
-        self.address = ipaddr.IPNetwork(node_data['data'][0], version=6)
+        self.address = address_from_string(node_data['data'][0],
+                mask = False)
 
     def addressFromString(self, address):
-        return ipaddr.IPNetwork(address, version=6)
+        return address_from_string(address)
 
     def listNetworks(self, include_missing = False):
         if include_missing:
             children = self.listChildren(include = ['ipv6 network'])
             missing = self.findMissingNetworks()
             all = list(children) + list(missing)
-            all.sort()
+            all.sort(key = treenodes.sort_key)
             return iter(all)
         else:
             return self.listChildren(include = ['ipv6 network'])
@@ -102,21 +325,21 @@ class Network(treenodes.BaseNode):
         self._purge()
 
     def isHost(self):
-        if self.address.first == self.address.last:
+        if self.address.netmask == all_ones:
             return True
         return False
 
     def strAddress(self):
-        return str(self.address.first)
+        return self.address.strAddress()
 
     def strNetmask(self):
-        return str(self.address.netmask)
+        return self.address.strNetmask()
 
     def strNetmaskCIDR(self):
         return self.address.prefixlen
 
     def size(self):
-        return self.address.numhosts
+        return self.address.end - self.address.start + 1
 
     def numAllocatedSubnets(self):
         return len(self.listChildren(include = ['ipv6 network']))
@@ -144,6 +367,11 @@ class Network(treenodes.BaseNode):
         
         The list consist of UnallocatedNetwork objects.
         """
+        if self.fetched_children:
+            return find_missing_networks(self.address.start,
+                    self.address.end, self.listChildren(
+                        fetch = False, include = ['ipv6 network'],
+                        sorted = False))
         missing = self.transport.findMissingNetworks(self.oid)
         return parse_missing_networks_list(missing)
 
@@ -167,7 +395,7 @@ class UnallocatedNetwork(object):
                 isinstance(other, UnallocatedNetwork)) or \
                 not other.class_name in ['ipv6 network', 'ipv6 network unallocated']:
             return super(UnallocatedNetwork, self).__lt__(other)
-        if self.address < other.address:
+        if self.sortKey() < other.sortKey():
             return True
         return False
 
@@ -180,6 +408,9 @@ class UnallocatedNetwork(object):
             return True
         return False
 
+    def sortKey(self):
+        return (self.address.start, self.address.netmask)
+
     def describe(self):
         return '%s:%s:%s' % (self.class_name, self.oid, self.address)
 
@@ -196,7 +427,7 @@ class UnallocatedNetwork(object):
         return self.getParent('network tree')
 
     def isHost(self):
-        if self.address.first == self.address.last:
+        if self.address.netmask == all_ones:
             return True
         return False
 
@@ -204,12 +435,13 @@ class UnallocatedNetwork(object):
         return str(self.address)
 
     def strNetmask(self):
-        return str(self.address.netmask)
+        return self.address.strNetmask()
 
     def strNetmaskCIDR(self):
         return self.address.prefixlen
 
 class Range(object):
+    """An ipv6 address range, start and end are unsigned integers."""
     def __init__(self, start, end):
         self.start = start
         self.end = end
@@ -218,7 +450,8 @@ class Range(object):
         return Range(self.start, self.end)
 
     def __repr__(self):
-        return '<IPV4.Range(%s, %s)>' % (self.start, self.end)
+        return '<IPV6.Range(%s, %s)>' % (self.printableStart(),
+                self.printableEnd())
 
     def __str__(self):
         return self.printable()
@@ -262,16 +495,18 @@ class Range(object):
         return False
 
     def printable(self):
-        return '%s - %s' % (str(self.start), str(self.end))
+        return '%s - %s' % (num_to_string(self.start),
+                num_to_string(self.end))
 
     def transportable(self):
-        return '%s %s' % (str(self.start), str(self.end))
+        return '%s %s' % (num_to_string(self.start),
+                num_to_string(self.end))
     
     def printableStart(self):
-        return str(self.start)
+        return num_to_string(self.start)
     
     def printableEnd(self):
-        return str(self.end)
+        return num_to_string(self.end)
     
 class NetworkRange(treenodes.BaseNode):
     class_id = 'IP6NR'
@@ -310,6 +545,9 @@ class NetworkRange(treenodes.BaseNode):
             return True
         return False
 
+    def sortKey(self):
+        return (self.range.start,)
+
     def describe(self):
         return '%s:%s:%s' % (self.class_name, self.oid, self.range)
 
@@ -364,13 +602,40 @@ class NetworkRange(treenodes.BaseNode):
 
 def parse_missing_networks_list(missing):
     for addr_string in missing:
-        address = ipaddr.IPNetwork(addr_string, version=6)
+        address = address_from_string(addr_string)
         network = UnallocatedNetwork(address)
         yield network
 
+def find_missing_networks(start, end, networks):
+    """Return the unallocated subnets of the address range start-end.
+
+    networks are the allocated networks (in any order), the gaps
+    between them are returned as a list of UnallocatedNetwork objects.
+    """
+    missing = []
+    pos = start
+    for network in sorted(networks, key = lambda n: n.address.start):
+        if network.address.start > pos:
+            missing.extend(UnallocatedNetwork(address) for address in
+                    range_to_addresses(pos, network.address.start - 1))
+        pos = max(pos, network.address.end + 1)
+    missing.extend(UnallocatedNetwork(address) for address in
+            range_to_addresses(pos, end))
+    return missing
+
+def range_to_addresses(start, end):
+    """Split the address range start-end into the largest cidr blocks."""
+    while start <= end:
+        host_bits = (end - start + 1).bit_length() - 1
+        if start:
+            host_bits = min(host_bits, (start & -start).bit_length() - 1)
+        yield Address(start, bitcount_netmasks[128 - host_bits],
+                mask = False, validate = False)
+        start += 1 << host_bits
+
 def is_valid_address_string(address):
     try:
-        a = ipaddr.IPNetwork(address, version=6)
+        a = address_from_string(address)
     except:
         return False
     return True
@@ -379,11 +644,23 @@ def address_from_string(address, mask = True, validate = True):
     """Return an Address object matching an address string.
 
     The address string must be an ipv6 address in cidr notion, ie.
-    nn.nn.nn.nn/mm.
+    nnnn:nnnn::nnnn/mm, addresses without a prefix length are /128.
 
     If an Address object is passed in it is returned untouched.
     """
-    return ipaddr.IPNetwork(address)
+    if type(address) == Address:
+        return address
+    # Make sure it's not confused with a range.
+    if ' ' in address:
+        raise errors.SiptrackError('invalid address string: %s' % address)
+    if '/' in address:
+        address, bits = address.split('/', 1)
+        netmask = bitcount_string_netmasks.get(bits)
+        if netmask is None:
+            raise errors.SiptrackError('invalid address string: invalid prefix length')
+    else:
+        netmask = all_ones
+    return Address(string_to_num(address), netmask, mask, validate)
 
 def is_valid_range_string(range):
     try:
@@ -405,7 +682,9 @@ def range_from_string(range):
     split = range.split()
     if len(split) != 2:
         raise errors.SiptrackError('invalid range string')
-    return Range(split[0], split[1])
+    start = string_to_num(split[0])
+    end = string_to_num(split[1])
+    return Range(start, end)
 
 # Add the objects in this module to the object registry.
 o = object_registry.registerClass(Network)
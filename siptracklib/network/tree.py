@@ -18,6 +18,8 @@ class NetworkTree(treenodes.BaseNode):
     def __init__(self, parent, protocol = None):
         super(NetworkTree, self).__init__(parent)
         self.protocol = protocol
+        # See networkIndex.
+        self._network_index = None
 
     def dictDescribe(self):
         data = super(NetworkTree, self).dictDescribe()
@@ -38,7 +40,7 @@ class NetworkTree(treenodes.BaseNode):
         if include_missing:
             missing = self.findMissingNetworks()
             all = list(children) + list(missing)
-            all.sort()
+            all.sort(key = treenodes.sort_key)
             children = iter(all)
         return children
 
@@ -56,6 +58,10 @@ class NetworkTree(treenodes.BaseNode):
 
     def getNetwork(self, address_string, create_if_missing = True):
         address = self.address(address_string)
+        if self._network_index is not None:
+            network = self._network_index.get(address)
+            if network is not None:
+                return network
         oid = self.transport.networkExists(self.oid, address.transportable())
         if oid is False:
             if create_if_missing:
@@ -63,6 +69,25 @@ class NetworkTree(treenodes.BaseNode):
             return None
         return self.root.getOID(oid)
 
+    def networkIndex(self):
+        """Return a local index of the networks in the tree.
+
+        The index is built from the networks currently loaded and kept
+        up to date as networks are loaded, added or removed. Fetch the
+        tree first to index all networks, see ipv4.NetworkIndex.
+        """
+        if self.protocol != 'ipv4':
+            raise errors.SiptrackError('network index only supported for ipv4 network trees')
+        if self._network_index is None:
+            self._network_index = ipv4.NetworkIndex(
+                    self.traverse(include_self = False,
+                        include = ['ipv4 network']))
+        return self._network_index
+
+    def findNetwork(self, address):
+        """Return the most specific loaded network containing address."""
+        return self.networkIndex().longestMatch(address)
+
     def getRange(self, range_string, create_if_missing = True):
         range = self.range(range_string)
         oid = self.transport.rangeExists(self.oid, range.transportable())
@@ -104,6 +129,15 @@ class NetworkTree(treenodes.BaseNode):
         
         The list consist of UnallocatedNetwork objects.
         """
+        if self.fetched_children:
+            networks = self.listChildren(fetch = False,
+                    include = ['%s network' % (self.protocol)],
+                    sorted = False)
+            if self.protocol == 'ipv4':
+                return ipv4.find_missing_networks(0, 0xffffffff, networks)
+            elif self.protocol == 'ipv6':
+                return ipv6.find_missing_networks(0, (1 << 128) - 1,
+                        networks)
         missing = self.transport.findMissingNetworks(self.oid)
         if self.protocol == 'ipv4':
             return ipv4.parse_missing_networks_list(missing)
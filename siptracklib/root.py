@@ -1,12 +1,81 @@
+import time
+from collections import OrderedDict
+
 from siptracklib import treenodes
 from siptracklib import view
 from siptracklib import password
 from siptracklib import errors
+from siptracklib import snapshot
 from siptracklib.objectregistry import object_registry
 
+# Default lifetime (in seconds) and max number of negative cache entries.
+default_negative_ttl = 60
+default_negative_size = 10000
+
+class NegativeCache(object):
+    """A cache of oids the server didn't return.
+
+    Oids that don't exist, or that the current user isn't allowed to
+    see, are remembered for ttl seconds so dangling links aren't
+    fetched over and over again. At most max_size oids are kept, the
+    oldest entries are dropped first.
+    """
+    def __init__(self, ttl = default_negative_ttl,
+            max_size = default_negative_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        # oid -> (expire time, non-existent flag)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def add(self, oid, nonexistent = False):
+        if self.max_size <= 0:
+            return
+        if oid in self._entries:
+            del self._entries[oid]
+        self._entries[oid] = (time.time() + self.ttl, nonexistent)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last = False)
+            self.evicted += 1
+
+    def lookup(self, oid):
+        """Return the non-existent flag for a cached oid, or None."""
+        entry = self._entries.get(oid)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, nonexistent = entry
+        if expires < time.time():
+            del self._entries[oid]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return nonexistent
+
+    def remove(self, oid):
+        if oid in self._entries:
+            del self._entries[oid]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'expired': self.expired, 'evicted': self.evicted,
+                'size': len(self._entries), 'max_size': self.max_size}
+
 class ObjectStore(object):
-    def __init__(self, transport):
+    def __init__(self, transport, negative_ttl = default_negative_ttl,
+            negative_size = default_negative_size):
         self.oid_mapping = {}
+        self.negative_cache = NegativeCache(negative_ttl, negative_size)
         self.root = self
         self.parent = None
         self.transport = transport
@@ -16,6 +85,8 @@ class ObjectStore(object):
                 self)
         self.view_tree.oid = '0'
         self.addedOID(self.view_tree.oid, self.view_tree)
+        # snapshot.SnapshotWriter loaded node data is written to.
+        self._snapshot_writer = None
 
     def _getOID(self, oid):
         if oid in self.oid_mapping:
@@ -30,18 +101,124 @@ class ObjectStore(object):
         if type(oids) != list:
             oids = [oids]
         missing = [oid for oid in oids if not self._getOID(oid)]
+        missing = self._skipNegative(missing)
         if len(missing) > 0:
-            for data in self.transport.cmd.iterFetchIterator(missing, 0,
-                                                      include_parents = True, include_associations = True,
-                                                      include_references = True):
-                self.loadChildren(data)
+            try:
+                for data in self.transport.cmd.iterFetchIterator(missing, 0,
+                                                          include_parents = True, include_associations = True,
+                                                          include_references = True):
+                    self.loadChildren(data)
+            except errors.NonExistent:
+                # With several oids we can't tell which one failed.
+                if len(missing) == 1:
+                    self.negative_cache.add(missing[0], nonexistent = True)
+                raise
+            for oid in missing:
+                if not self._getOID(oid):
+                    self.negative_cache.add(oid)
         for oid in oids:
             yield self._getOID(oid)
 
+    def _skipNegative(self, oids):
+        """Remove oids in the negative cache from a list of oids to fetch.
+
+        Raises NonExistent if an oid is cached as non-existent, just
+        like the server would have.
+        """
+        ret = []
+        for oid in oids:
+            nonexistent = self.negative_cache.lookup(oid)
+            if nonexistent is None:
+                ret.append(oid)
+            elif nonexistent:
+                raise errors.NonExistent('oid does not exist: %s' % (oid))
+        return ret
+
+    def negativeCacheStats(self):
+        return self.negative_cache.stats()
+
+    def resolveOIDs(self, oids):
+        """Return a list of nodes for oids, skipping non-existent oids.
+
+        All oids that aren't already loaded are fetched with a single
+        request. If that fails because an oid doesn't exist (anymore)
+        the remaining oids are fetched one at a time.
+        """
+        oids = list(oids)
+        try:
+            nodes = list(self.getOIDs(oids))
+        except errors.NonExistent:
+            nodes = []
+            for oid in oids:
+                try:
+                    nodes.append(self.getOID(oid))
+                except errors.NonExistent:
+                    continue
+        return [node for node in nodes if node]
+
+    def prefetchLinks(self, nodes):
+        """Load the associations and references of nodes.
+
+        Links for all nodes are fetched with a single request, rather
+        than one request per link when they are first accessed.
+        """
+        oids = set()
+        for node in nodes:
+            oids.update(node._associations)
+            oids.update(node._references)
+        self.resolveOIDs([oid for oid in oids if oid not in self.oid_mapping])
+
     def fetch(self, *args, **kwargs):
         """Convenience function."""
         return self.view_tree.fetch(*args, **kwargs)
 
+    def fetchSnapshot(self, filename, max_age = snapshot.default_max_age):
+        """Fetch the whole tree, using a local snapshot if possible.
+
+        If filename is a snapshot saved for the same server and user that
+        is at most max_age seconds old, and its top level nodes match the
+        servers, the tree is loaded from it. Otherwise the whole tree is
+        fetched from the server and written to filename as it's received.
+        Local changes made after fetching are not written to the
+        snapshot.
+
+        Returns True if the snapshot was used.
+        """
+        key = snapshot.make_snapshot_key(self.transport,
+                self.transport.cmd.sessionUserOID(),
+                self.transport.cmd.version())
+        if snapshot.is_valid_snapshot(filename, key, max_age) and \
+                self._snapshotTopLevelMatches(filename):
+            self.loadChildren(snapshot.iter_snapshot(filename))
+            self.view_tree._markFetched(-1)
+            return True
+        writer = snapshot.SnapshotWriter(filename, key)
+        self._snapshot_writer = writer
+        try:
+            self.fetch(-1)
+        except:
+            writer.abort()
+            raise
+        finally:
+            self._snapshot_writer = None
+        writer.close()
+        return False
+
+    def _snapshotTopLevelMatches(self, filename):
+        """Compare the top level nodes of a snapshot to the servers.
+
+        A single shallow fetch that catches views added, removed or
+        hidden by permission changes since the snapshot was saved.
+        """
+        oids = set()
+        for data in self.transport.cmd.iterFetchIterator(self.view_tree.oid,
+                1, False, False, False):
+            for node_data in data:
+                if node_data['parent'] == self.view_tree.oid:
+                    oids.add(node_data['oid'])
+        return oids == set(snapshot.list_children(filename,
+            self.view_tree.oid))
+
     def getSessionUser(self):
         oid = self.transport.cmd.sessionUserOID()
         return self.getOID(oid)
@@ -56,14 +233,16 @@ class ObjectStore(object):
 
     def quicksearch(self, search_pattern, attr_limit = [], include = [],
                     exclude = [], sorted = True, fuzzy = True, default_fields = ['name', 'description'],
-                    max_results = 0):
+                    max_results = 0, prefetch_links = False):
         oids = []
         for data, _oids in self.transport_root.cmd.iterQuicksearchIterator(search_pattern,
                                                                            attr_limit, include, exclude, False, False, False, False, fuzzy, default_fields, max_results):
             oids.extend(_oids)
         nodes = list(self.getOIDs(oids))
+        if prefetch_links:
+            self.prefetchLinks(nodes)
         if sorted:
-            nodes.sort()
+            nodes.sort(key = treenodes.sort_key)
         return nodes
 
     def localSearch(self, *args, **kwargs):
@@ -72,6 +251,7 @@ class ObjectStore(object):
 
     def addedOID(self, oid, node):
         self.oid_mapping[oid] = node
+        self.negative_cache.remove(oid)
 
     def removedOID(self, oid):
         if oid in self.oid_mapping:
@@ -79,6 +259,8 @@ class ObjectStore(object):
 
     def loadChildren(self, transport_data, force = False):
         for node_data in transport_data:
+            if self._snapshot_writer is not None:
+                self._snapshot_writer.add(node_data)
             if node_data['oid'] in self.oid_mapping:
                 # If force, have the node reload it's data even if it
                 # already exists.
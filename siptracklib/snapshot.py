@@ -0,0 +1,163 @@
+"""On-disk snapshots of loaded object store data.
+
+A snapshot is an sqlite database containing the raw node data received
+from the server during a full fetch, in the order it was received (ie.
+parents before children), so the tree can be rebuilt with
+ObjectStore.loadChildren without contacting the server.
+
+Snapshots are tied to a key (server, port, server version and session
+user), a snapshot saved by one user is never loaded for another user or
+server, which keeps nodes the current user isn't allowed to see out of
+the tree. Rows are written in batches while the tree is being fetched
+(see SnapshotWriter), so the raw node data isn't kept in memory next to
+the tree.
+
+Snapshots are currently only used by siptrack-generate-dns (see
+ObjectStore.fetchSnapshot). The server has no tree or permission
+version, so besides max_age a snapshot is only checked against the
+servers current top level nodes (list_children) when loaded. Other
+changes, including permission changes further down the tree, aren't
+seen until the snapshot is older than max_age.
+"""
+import os
+import tempfile
+import sqlite3
+import time
+import zlib
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from siptracklib import errors
+
+# Bump when the snapshot layout or node data format changes.
+snapshot_version = '2'
+
+# Default maximum snapshot age in seconds.
+default_max_age = 300
+
+# Rows inserted per executemany call while writing a snapshot.
+write_batch_size = 1000
+
+def make_snapshot_key(transport, user_oid, server_version):
+    """Return the key identifying snapshots valid for a connection."""
+    return '%s:%s:%s:%s' % (transport.hostname, transport.port,
+            server_version, user_oid)
+
+def _connect(filename):
+    return sqlite3.connect(filename)
+
+class SnapshotWriter(object):
+    """Write node data to a new snapshot as it's received.
+
+    Rows are inserted in batches of write_batch_size into a temporary
+    file next to filename, close() commits and moves it into place,
+    abort() removes it.
+    """
+    def __init__(self, filename, key):
+        self.filename = filename
+        # mkstemp creates the file exclusively, readable only by the
+        # current user (node data can include encrypted passwords etc.).
+        fd, self.tmp_filename = tempfile.mkstemp(prefix = '.snapshot-',
+                dir = os.path.dirname(os.path.abspath(filename)))
+        os.close(fd)
+        self.rows = []
+        try:
+            self.db = _connect(self.tmp_filename)
+            self.db.execute('create table meta (name text primary key, '
+                    'value text)')
+            self.db.execute('create table nodes (oid text, parent text, '
+                    'data blob)')
+            self.db.executemany('insert into meta values (?, ?)', [
+                ('version', snapshot_version),
+                ('key', key),
+                ('created', str(time.time())),
+                ])
+        except:
+            self.abort()
+            raise
+
+    def add(self, node_data):
+        self.rows.append((node_data['oid'], node_data['parent'],
+            buffer(zlib.compress(json.dumps(node_data)))))
+        if len(self.rows) >= write_batch_size:
+            self._flush()
+
+    def _flush(self):
+        self.db.executemany('insert into nodes values (?, ?, ?)', self.rows)
+        self.rows = []
+
+    def close(self):
+        try:
+            self._flush()
+            self.db.commit()
+            self.db.close()
+            self.db = None
+            os.rename(self.tmp_filename, self.filename)
+        except:
+            self.abort()
+            raise
+
+    def abort(self):
+        if getattr(self, 'db', None) is not None:
+            self.db.close()
+            self.db = None
+        if os.path.exists(self.tmp_filename):
+            os.unlink(self.tmp_filename)
+
+def _read_meta(db):
+    meta = {}
+    for name, value in db.execute('select name, value from meta'):
+        meta[name] = value
+    return meta
+
+def is_valid_snapshot(filename, key, max_age):
+    """Check if a snapshot exists, matches key and is recent enough."""
+    if not os.path.isfile(filename):
+        return False
+    try:
+        db = _connect(filename)
+        try:
+            meta = _read_meta(db)
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return False
+    if meta.get('version') != snapshot_version or meta.get('key') != key:
+        return False
+    try:
+        created = float(meta.get('created'))
+    except (TypeError, ValueError):
+        return False
+    if max_age is not None and time.time() - created > max_age:
+        return False
+    return True
+
+def iter_snapshot(filename):
+    """Iterate over the node data dicts stored in a snapshot."""
+    db = _connect(filename)
+    try:
+        try:
+            for (data,) in db.execute('select data from nodes order by rowid'):
+                yield json.loads(zlib.decompress(str(data)))
+        except sqlite3.Error, e:
+            raise errors.SiptrackError('invalid snapshot file: %s' % (e))
+    finally:
+        db.close()
+
+def list_children(filename, parent):
+    """Return the oids of the nodes in a snapshot with parent parent."""
+    db = _connect(filename)
+    try:
+        try:
+            return [oid for (oid,) in db.execute(
+                'select oid from nodes where parent = ?', (parent,))]
+        except sqlite3.Error, e:
+            raise errors.SiptrackError('invalid snapshot file: %s' % (e))
+    finally:
+        db.close()
+
+def remove_snapshot(filename):
+    if os.path.exists(filename):
+        os.unlink(filename)
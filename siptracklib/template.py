@@ -10,7 +10,7 @@ def suggest_templates(base_node, template_type):
         template = base_node.root.getOID(oid)
         if template:
             templates.append(template)
-    templates.sort()
+    templates.sort(key = treenodes.sort_key)
     return templates
 
 class BaseTemplate(treenodes.BaseNode):
@@ -1,5 +1,3 @@
-from siptracklib.transport.registry import register_transports
+from siptracklib.transport.registry import TransportRegistry
 
-transports = {}
-
-register_transports(transports)
+transports = TransportRegistry()
@@ -1,7 +1,25 @@
-from siptracklib.transport import xmlrpc
+"""Available transports.
 
-def register_transports(transports):
-    if len(transports) != 0:
-        return
-    transports['default'] = xmlrpc.Transport
-    transports['xmlrpc'] = xmlrpc.Transport
+Transport classes are imported when they're first looked up, so
+importing siptracklib doesn't import xmlrpclib, httplib, ssl etc.
+"""
+
+# Transport name -> (module, class name).
+transport_classes = {
+        'default': ('siptracklib.transport.xmlrpc.transport', 'Transport'),
+        'xmlrpc': ('siptracklib.transport.xmlrpc.transport', 'Transport'),
+        }
+
+class TransportRegistry(dict):
+    """Transport classes by name, imported on first lookup."""
+    def __missing__(self, name):
+        if name not in transport_classes:
+            raise KeyError(name)
+        module_name, class_name = transport_classes[name]
+        module = __import__(module_name, fromlist = [class_name])
+        transport = getattr(module, class_name)
+        self[name] = transport
+        return transport
+
+    def __contains__(self, name):
+        return name in transport_classes or dict.__contains__(self, name)
@@ -1,10 +1,30 @@
 class BaseRPC(object):
+    # Path of the section below Transport.cmd, '' for Transport.cmd.
+    section_path = ''
+
     def __init__(self, transport):
         self.transport = transport
 
+    def __getattr__(self, name):
+        # Sub sections are created when first used, see
+        # transport.rpc_sections.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        path = name
+        if self.section_path:
+            path = '%s.%s' % (self.section_path, name)
+        section = self.transport._createSection(path)
+        if section is None:
+            raise AttributeError(name)
+        setattr(self, name, section)
+        return section
+
     def send(self, command, *args):
         if self.command_path:
             command = '%s.%s' % (self.command_path, command)
+        batch = self.transport._getBatch()
+        if batch is not None:
+            return batch.queue(command, (self.transport.session_id,) + args)
         return self.transport._sendCommand(command, self.transport.session_id,
                 *args)
 
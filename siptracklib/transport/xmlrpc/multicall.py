@@ -0,0 +1,174 @@
+"""Batching of siptrack xmlrpc commands.
+
+Commands sent while a Batch is active are queued and sent to the server
+in a single system.multicall request. If the server doesn't support
+system.multicall the queued commands are sent one by one instead.
+"""
+import xmlrpclib
+import time
+
+from siptracklib.errors import SiptrackError
+
+default_max_calls = 1000
+
+# Fault codes used by xmlrpc servers for unknown methods.
+method_not_found_faults = [8001, -32601]
+
+class BatchResult(object):
+    """The (future) result of a batched command.
+
+    The result is available once the batch has been flushed.
+    """
+    def __init__(self, command):
+        self.command = command
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def __repr__(self):
+        return '<BatchResult(%s)>' % (self.command)
+
+    def done(self):
+        """True if the batch containing the command has been flushed."""
+        return self._done
+
+    def failed(self):
+        return self._error is not None
+
+    def result(self):
+        """Return the command result.
+
+        Raises the siptrack exception matching the commands fault code
+        if the command failed.
+        """
+        if not self._done:
+            raise SiptrackError('batched command %s not sent yet' % (
+                self.command))
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _setResult(self, value):
+        self._value = value
+        self._done = True
+
+    def _setError(self, error):
+        self._error = error
+        self._done = True
+
+class Batch(object):
+    """A batch of queued commands, see Transport.batch."""
+    def __init__(self, transport, max_calls = default_max_calls):
+        self.transport = transport
+        self.max_calls = max_calls
+        self.calls = []
+        self.errors = []
+        self._outer = None
+
+    def __enter__(self):
+        outer = self.transport._getBatch()
+        if outer is not None:
+            self._outer = outer
+            return outer
+        self.transport._batch_state.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._outer is not None:
+            return False
+        self.transport._batch_state.batch = None
+        if exc_type is not None:
+            self.abort()
+            return False
+        self.flush()
+        if self.errors:
+            raise self.errors[0]
+        return False
+
+    def queue(self, command, args):
+        """Queue a command, returns a BatchResult for the command."""
+        result = BatchResult(command)
+        self.calls.append((command, args, result))
+        if len(self.calls) >= self.max_calls:
+            self.flush()
+        return result
+
+    def abort(self):
+        """Drop all queued commands without sending them."""
+        calls = self.calls
+        self.calls = []
+        for command, args, result in calls:
+            result._setError(SiptrackError('batch aborted'))
+
+    def flush(self):
+        """Send all queued commands."""
+        calls = self.calls
+        self.calls = []
+        if len(calls) == 0:
+            return
+        if self.transport.multicall_supported:
+            if self._sendMulticall(calls):
+                return
+        self._sendSingle(calls)
+
+    def _failCalls(self, calls, error):
+        """Mark the results of calls that weren't sent as failed."""
+        for command, args, result in calls:
+            if not result.done():
+                result._setError(error)
+
+    def _sendMulticall(self, calls):
+        """Send calls in a single system.multicall request.
+
+        Returns False if the server doesn't support system.multicall.
+        If the request as a whole fails, every result is marked as
+        failed with the error before it's raised.
+        """
+        multicall = [{'methodName': command, 'params': list(args)}
+                for command, args, result in calls]
+        try:
+            start = time.time()
+            ret = getattr(self.transport._connection,
+                    'system.multicall')(multicall)
+            end = time.time()
+            if self.transport.debug:
+                print 'RPC MULTICALL %d calls: %s' % (len(calls), end - start)
+        except xmlrpclib.Fault, e:
+            if e.faultCode in method_not_found_faults:
+                self.transport.multicall_supported = False
+                return False
+            error = self.transport._convertFault(e.faultCode, e.faultString)
+            if error is None:
+                self._failCalls(calls, e)
+                raise
+            self._failCalls(calls, error)
+            raise error
+        except Exception, e:
+            self._failCalls(calls, e)
+            raise
+        if len(ret) != len(calls):
+            error = SiptrackError('invalid multicall reply from server')
+            self._failCalls(calls, error)
+            raise error
+        for (command, args, result), value in zip(calls, ret):
+            if type(value) == dict:
+                error = self.transport._convertFault(value.get('faultCode'),
+                        value.get('faultString'))
+                if error is None:
+                    error = xmlrpclib.Fault(value.get('faultCode'),
+                            value.get('faultString'))
+                result._setError(error)
+                self.errors.append(error)
+            else:
+                result._setResult(value[0])
+        return True
+
+    def _sendSingle(self, calls):
+        for command, args, result in calls:
+            try:
+                value = self.transport._sendCommand(command, *args)
+            except (SiptrackError, xmlrpclib.Fault), e:
+                result._setError(e)
+                self.errors.append(e)
+            else:
+                result._setResult(value)
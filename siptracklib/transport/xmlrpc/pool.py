@@ -0,0 +1,186 @@
+"""Persistent HTTP connection pooling for the siptrack xmlrpc transport.
+
+xmlrpclib.ServerProxy normally keeps at most a single cached connection
+per transport instance and that connection can't be shared between
+threads. PooledTransport keeps a bounded pool of HTTP/1.1 keep-alive
+connections instead, so consecutive RPC calls don't have to pay for a
+new TCP (and SSL) handshake and several threads can share one transport.
+"""
+import xmlrpclib
+import httplib
+import threading
+import socket
+import errno
+
+default_pool_size = 4
+
+class ConnectionPool(object):
+    """A thread safe pool of idle keep-alive http(s) connections.
+
+    At most pool_size idle connections are kept around, connections
+    returned to a full pool are closed. Pool hits/misses are counted
+    so the effectiveness of the pool can be checked.
+    """
+    def __init__(self, host, use_ssl = False, pool_size = default_pool_size,
+            ssl_context = None):
+        self.host = host
+        self.use_ssl = use_ssl
+        self.pool_size = pool_size
+        self.ssl_context = ssl_context
+        self.hits = 0
+        self.misses = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _makeConnection(self):
+        if self.use_ssl:
+            if self.ssl_context is not None:
+                return httplib.HTTPSConnection(self.host,
+                        context = self.ssl_context)
+            return httplib.HTTPSConnection(self.host)
+        return httplib.HTTPConnection(self.host)
+
+    def get(self):
+        """Return a connection and a flag telling if it was reused."""
+        self._lock.acquire()
+        try:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop(), True
+            self.misses += 1
+        finally:
+            self._lock.release()
+        return self._makeConnection(), False
+
+    def put(self, connection):
+        """Return a connection to the pool after a completed request."""
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def discard(self, connection):
+        """Close a connection that is in an unknown state."""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close all idle connections."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+        finally:
+            self._lock.release()
+        for connection in idle:
+            self.discard(connection)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'idle': len(self._idle), 'pool_size': self.pool_size}
+
+class PooledTransport(xmlrpclib.Transport):
+    """An xmlrpclib transport using a ConnectionPool.
+
+    Can be passed to xmlrpclib.ServerProxy as the transport argument.
+    Unlike the default xmlrpclib transports no per-request state is
+    stored on the transport instance, which makes it safe to use from
+    several threads at once.
+    """
+    def __init__(self, use_ssl = False, pool_size = default_pool_size,
+            ssl_context = None, use_datetime = 0):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.use_ssl = use_ssl
+        self.pool_size = pool_size
+        self.ssl_context = ssl_context
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def _getPool(self, host):
+        self._pools_lock.acquire()
+        try:
+            if host not in self._pools:
+                chost, extra_headers, x509 = self.get_host_info(host)
+                self._pools[host] = (ConnectionPool(chost, self.use_ssl,
+                    self.pool_size, self.ssl_context), extra_headers)
+            return self._pools[host]
+        finally:
+            self._pools_lock.release()
+
+    def request(self, host, handler, request_body, verbose = 0):
+        pool, extra_headers = self._getPool(host)
+        # Retry with another connection if a reused connection has been
+        # closed by the server while it was idle.
+        while True:
+            connection, reused = pool.get()
+            try:
+                return self._singleRequest(pool, connection, host, handler,
+                        request_body, extra_headers, verbose)
+            except socket.error, e:
+                if not reused or e.errno not in (errno.ECONNRESET,
+                        errno.ECONNABORTED, errno.EPIPE):
+                    raise
+            except httplib.BadStatusLine:
+                if not reused:
+                    raise
+
+    def _singleRequest(self, pool, connection, host, handler, request_body,
+            extra_headers, verbose):
+        if verbose:
+            connection.set_debuglevel(1)
+        try:
+            self.send_request(connection, handler, request_body)
+            if extra_headers:
+                for key, value in extra_headers:
+                    connection.putheader(key, value)
+            self.send_user_agent(connection)
+            self.send_content(connection, request_body)
+            response = connection.getresponse(buffering = True)
+            if response.status == 200:
+                self.verbose = verbose
+                ret = self.parse_response(response)
+                if response.will_close:
+                    pool.discard(connection)
+                else:
+                    pool.put(connection)
+                return ret
+        except xmlrpclib.Fault:
+            # The response has been completely read, the connection
+            # can still be used.
+            if response.will_close:
+                pool.discard(connection)
+            else:
+                pool.put(connection)
+            raise
+        except Exception:
+            pool.discard(connection)
+            raise
+        pool.discard(connection)
+        raise xmlrpclib.ProtocolError(host + handler, response.status,
+                response.reason, response.msg)
+
+    def close(self):
+        self._pools_lock.acquire()
+        try:
+            pools = self._pools.values()
+            self._pools = {}
+        finally:
+            self._pools_lock.release()
+        for pool, extra_headers in pools:
+            pool.close()
+
+    def stats(self):
+        """Return combined hit/miss counters for all pools."""
+        ret = {'hits': 0, 'misses': 0, 'idle': 0, 'pool_size': self.pool_size}
+        for pool, extra_headers in self._pools.values():
+            stats = pool.stats()
+            ret['hits'] += stats['hits']
+            ret['misses'] += stats['misses']
+            ret['idle'] += stats['idle']
+        return ret
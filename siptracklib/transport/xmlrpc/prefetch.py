@@ -0,0 +1,115 @@
+"""Pipelined fetching of paged iter_fetch/iter_search results.
+
+The server returns large fetch/search results in pages, each page
+containing the id of the next one. prefetch_pages fetches and decodes
+the following pages in a worker thread while the caller is still busy
+processing the current page.
+
+If decode returns a generator (see root.iter_decode_fetch_data) the
+worker queues the decoded entries in chunks of at most chunk_entries
+entries rather than whole pages, so the decompression and json decoding
+overlap with the caller while at most read_ahead chunks of decoded
+entries (plus the raw page being decoded) are held in memory. Other
+decoders (search results) are queued a page at a time. The first page,
+and every page when read_ahead is 0, is decoded incrementally in the
+calling thread.
+"""
+import threading
+import Queue
+import sys
+import types
+
+default_read_ahead = 2
+
+# Maximum number of decoded entries per queued chunk.
+chunk_entries = 1000
+
+class PageFetcher(threading.Thread):
+    """Worker thread fetching and decoding pages into a bounded queue.
+
+    The queue holds at most read_ahead items, chunks of decoded entries
+    or whole decoded pages, see the module docstring.
+    """
+    # How often (seconds) a blocked worker checks if it has been stopped.
+    poll_interval = 0.5
+
+    def __init__(self, result, next_method, decode, read_ahead):
+        super(PageFetcher, self).__init__()
+        self.daemon = True
+        self.result = result
+        self.next_method = next_method
+        self.decode = decode
+        self.queue = Queue.Queue(read_ahead)
+        self.stopped = threading.Event()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, True, self.poll_interval)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _putPage(self, page):
+        if type(page) != types.GeneratorType:
+            return self._put(('data', page))
+        chunk = []
+        for entry in page:
+            chunk.append(entry)
+            if len(chunk) >= chunk_entries:
+                if not self._put(('data', chunk)):
+                    return False
+                chunk = []
+        if chunk:
+            return self._put(('data', chunk))
+        return True
+
+    def run(self):
+        try:
+            result = self.result
+            while result['next'] and not self.stopped.is_set():
+                result = self.next_method(result['next'])
+                if result['data']:
+                    if not self._putPage(self.decode(result['data'])):
+                        return
+        except:
+            self._put(('error', sys.exc_info()))
+            return
+        self._put(('done', None))
+
+    def stop(self):
+        self.stopped.set()
+
+def prefetch_pages(first_method, next_method, decode, read_ahead, *args,
+        **kwargs):
+    """Iterate over decoded result pages.
+
+    The first page is fetched in the calling thread (so errors in the
+    actual request are raised directly), the rest by a PageFetcher,
+    which may split a page in several chunks of entries.
+    If read_ahead is 0 all pages are fetched serially.
+    """
+    result = first_method(*args, **kwargs)
+    if result['data']:
+        yield decode(result['data'])
+    if not result['next']:
+        return
+    if read_ahead < 1:
+        while result['next']:
+            result = next_method(result['next'])
+            if result['data']:
+                yield decode(result['data'])
+        return
+    fetcher = PageFetcher(result, next_method, decode, read_ahead)
+    fetcher.start()
+    try:
+        while True:
+            type, data = fetcher.queue.get()
+            if type == 'done':
+                break
+            elif type == 'error':
+                raise data[0], data[1], data[2]
+            yield data
+    finally:
+        fetcher.stop()
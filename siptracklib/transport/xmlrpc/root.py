@@ -1,14 +1,101 @@
 from siptracklib.transport.xmlrpc import baserpc
+from siptracklib.transport.xmlrpc import prefetch
 import xmlrpclib
 import zlib
+import re
 try:
     import simplejson
     json_encode = simplejson.dumps
     json_decode = simplejson.loads
+    JSONDecoder = simplejson.JSONDecoder
 except:
     import json
     json_encode = json.dumps
     json_decode = json.loads
+    JSONDecoder = json.JSONDecoder
+
+from siptracklib import errors
+
+# Size of the compressed chunks fed to the decompressor when decoding
+# fetch pages.
+decode_chunk_size = 64 * 1024
+_whitespace = re.compile(r'[ \t\n\r]*')
+_separator = re.compile(r'[ \t\n\r]*,[ \t\n\r]*')
+
+def iter_decode_fetch_data(data, chunk_size = decode_chunk_size):
+    """Incrementally decode a fetch page, yielding one node dict at a time.
+
+    A fetch page is a zlib compressed json list of entries. Rather than
+    decompressing and decoding the whole page at once the page is
+    decompressed in chunks and entries are decoded as soon as they are
+    complete, so only a small part of the decompressed page is kept in
+    memory at any time.
+
+    Pages read ahead by prefetch.PageFetcher are decoded in the worker
+    thread and queued in bounded chunks of entries, see prefetch.
+    """
+    decompressor = zlib.decompressobj()
+    decoder = JSONDecoder()
+    scan_once = decoder.scan_once
+    decode = decoder.decode
+    match_whitespace = _whitespace.match
+    match_separator = _separator.match
+    data = str(data)
+    buf = ''
+    pos = 0
+    started = False
+    offset = 0
+    final = False
+    while True:
+        if offset < len(data):
+            buf = buf[pos:] + decompressor.decompress(
+                    data[offset:offset + chunk_size])
+            offset += chunk_size
+        elif not final:
+            buf = buf[pos:] + decompressor.flush()
+            final = True
+        else:
+            raise errors.InvalidServerData('truncated fetch data')
+        pos = 0
+        buf_len = len(buf)
+        while True:
+            pos = match_whitespace(buf, pos).end()
+            if pos >= buf_len:
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise errors.InvalidServerData('invalid fetch data')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            # Decode as many entries as possible without going through
+            # the outer loop again.
+            while True:
+                try:
+                    entry, end = scan_once(buf, pos)
+                except (ValueError, StopIteration):
+                    # Most likely an incomplete entry, wait for more data.
+                    if final:
+                        raise errors.InvalidServerData('invalid fetch data')
+                    end = -1
+                # Make sure the entry is followed by something, otherwise
+                # it might have been cut short.
+                if end == -1 or (end >= buf_len and not final):
+                    break
+                # Entries are json encoded strings themselves.
+                yield decode(entry)
+                pos = end
+                match = match_separator(buf, pos)
+                if match is None or match.end() >= buf_len:
+                    break
+                pos = match.end()
+            if end == -1 or end >= buf_len:
+                break
 
 class RootRPC(baserpc.BaseRPC):
     command_path = ''
@@ -51,21 +138,12 @@ class RootRPC(baserpc.BaseRPC):
         return self.send('iter_fetch_next', next_id)
 
     def iterFetchIterator(self, *args, **kwargs):
-        result = self.iterFetch(*args, **kwargs)
-        if result['data']:
-            yield self._decodeFetchData(result['data'])
-        while result['next']:
-            result = self.iterFetchNext(result['next'])
-            if result['data']:
-                yield self._decodeFetchData(result['data'])
+        return prefetch.prefetch_pages(self.iterFetch, self.iterFetchNext,
+                self._decodeFetchData, self.transport.fetch_read_ahead,
+                *args, **kwargs)
 
     def _decodeFetchData(self, data):
-        data = zlib.decompress(str(data))
-        data = json_decode(data)
-        new_data = []
-        for ent in data:
-            new_data.append(json_decode(ent))
-        return new_data
+        return iter_decode_fetch_data(data)
 
     def iterSearch(self, oid, search_pattern, attr_limit, include, exclude,
             no_match_break, include_data, include_parents, include_associations,
@@ -95,21 +173,15 @@ class RootRPC(baserpc.BaseRPC):
         return self._iterSearchIterator(self.iterQuicksearch, self.iterQuicksearchNext, *args, **kwargs)
 
     def _iterSearchIterator(self, search_method, next_method, *args, **kwargs):
-        result = search_method(*args, **kwargs)
-        if result['data']:
-            yield self._decodeSearchData(result['data'])
-        while result['next']:
-            result = next_method(result['next'])
-            if result['data']:
-                yield self._decodeSearchData(result['data'])
+        return prefetch.prefetch_pages(search_method, next_method,
+                self._decodeSearchData, self.transport.fetch_read_ahead,
+                *args, **kwargs)
 
     def _decodeSearchData(self, data):
         data = zlib.decompress(str(data))
         data = json_decode(data)
         match_data, oids = data
-        new_data = []
-        for ent in match_data:
-            new_data.append(json_decode(ent))
+        new_data = [json_decode(ent) for ent in match_data]
         return new_data, oids
 
     def associate(self, oid_1, oid_2):
@@ -5,24 +5,15 @@ Used for communicating with siptrack servers via xmlrpc.
 import xmlrpclib
 import socket
 import time
+import threading
 
 from siptracklib.errors import SiptrackError, AlreadyExists, NonExistent, InvalidLocation
 import siptracklib.errors
 
 from siptracklib.transport.xmlrpc import root
-from siptracklib.transport.xmlrpc import container
-from siptracklib.transport.xmlrpc import attribute
-from siptracklib.transport.xmlrpc import counter
-from siptracklib.transport.xmlrpc import device
-from siptracklib.transport.xmlrpc import network
-from siptracklib.transport.xmlrpc import password
-from siptracklib.transport.xmlrpc import view
-from siptracklib.transport.xmlrpc import user
-from siptracklib.transport.xmlrpc import template
-from siptracklib.transport.xmlrpc import confignode
-from siptracklib.transport.xmlrpc import permission
-from siptracklib.transport.xmlrpc import event
-from siptracklib.transport.xmlrpc import deviceconfig
+from siptracklib.transport.xmlrpc import pool
+from siptracklib.transport.xmlrpc import multicall
+from siptracklib.transport.xmlrpc import prefetch
 
 transport_class_id_mapping = {
         'CT'  : ['container', 'tree'],
@@ -83,6 +74,74 @@ transport_class_id_mapping = {
         'ETRP'   : ['event', 'trigger', 'rule', 'python'],
         }
 
+# Transport sections below Transport.cmd, created when first used (see
+# _createSection): section path -> (rpc module, class name).
+rpc_sections = {
+        'container': ('container', 'ContainerRPC'),
+        'container.tree': ('container', 'ContainerTreeRPC'),
+        'counter': ('counter', 'CounterRPC'),
+        'counter.loop': ('counter', 'CounterLoopRPC'),
+        'device': ('device', 'DeviceRPC'),
+        'device.tree': ('device', 'DeviceTreeRPC'),
+        'device.category': ('device', 'DeviceCategoryRPC'),
+        'device.config': ('deviceconfig', 'DeviceConfigRPC'),
+        'device.config.template': ('deviceconfig', 'DeviceConfigTemplateRPC'),
+        'template': ('template', 'TemplateRPC'),
+        'template.device': ('template', 'DeviceTemplateRPC'),
+        'template.network': ('template', 'NetworkTemplateRPC'),
+        'template.rule': ('template', 'TemplateRuleRPC'),
+        'template.rule.password': ('template', 'TemplateRulePasswordRPC'),
+        'template.rule.assign_network': ('template', 'TemplateRuleAssignNetworkRPC'),
+        'template.rule.subdevice': ('template', 'TemplateRuleSubdeviceRPC'),
+        'template.rule.text': ('template', 'TemplateRuleTextRPC'),
+        'template.rule.fixed': ('template', 'TemplateRuleFixedRPC'),
+        'template.rule.regmatch': ('template', 'TemplateRuleRegmatchRPC'),
+        'template.rule.bool': ('template', 'TemplateRuleBoolRPC'),
+        'template.rule.int': ('template', 'TemplateRuleIntRPC'),
+        'template.rule.delete_attribute': ('template', 'TemplateRuleDeleteAttributeRPC'),
+        'template.rule.flush_nodes': ('template', 'TemplateRuleFlushNodesRPC'),
+        'template.rule.flush_associations': ('template', 'TemplateRuleFlushAssociationsRPC'),
+        'password': ('password', 'PasswordRPC'),
+        'password.key': ('password', 'PasswordKeyRPC'),
+        'password.subkey': ('password', 'SubKeyRPC'),
+        'password.tree': ('password', 'PasswordTreeRPC'),
+        'password.category': ('password', 'PasswordCategoryRPC'),
+        'user': ('user', 'UserRPC'),
+        'user.local': ('user', 'UserLocalRPC'),
+        'user.ldap': ('user', 'UserLDAPRPC'),
+        'user.ad': ('user', 'UserActiveDirectoryRPC'),
+        'user.manager': ('user', 'UserManagerRPC'),
+        'user.manager.local': ('user', 'UserManagerLocalRPC'),
+        'user.manager.ldap': ('user', 'UserManagerLDAPRPC'),
+        'user.manager.ad': ('user', 'UserManagerActiveDirectoryRPC'),
+        'user.group': ('user', 'UserGroupRPC'),
+        'user.group.ldap': ('user', 'UserGroupLDAPRPC'),
+        'user.group.ad': ('user', 'UserGroupActiveDirectoryRPC'),
+        'view': ('view', 'ViewRPC'),
+        'view.tree': ('view', 'ViewTreeRPC'),
+        'network': ('network', 'NetworkRPC'),
+        'network.tree': ('network', 'NetworkTreeRPC'),
+        'network.ipv4': ('network', 'NetworkIPV4RPC'),
+        'network.ipv6': ('network', 'NetworkIPV6RPC'),
+        'network.range': ('network', 'NetworkRangeRPC'),
+        'network.range.ipv4': ('network', 'NetworkRangeIPV4RPC'),
+        'network.range.ipv6': ('network', 'NetworkRangeIPV6RPC'),
+        'attribute': ('attribute', 'AttributeRPC'),
+        'attribute.versioned': ('attribute', 'VersionedAttributeRPC'),
+        'attribute.encrypted': ('attribute', 'EncryptedAttributeRPC'),
+        'config': ('confignode', 'ConfigRPC'),
+        'config.section': ('confignode', 'ConfigSectionRPC'),
+        'config.network_autoassign': ('confignode', 'ConfigNetworkAutoassignRPC'),
+        'config.value': ('confignode', 'ConfigValueRPC'),
+        'permission': ('permission', 'PermissionRPC'),
+        'command': ('event', 'CommandRPC'),
+        'command.queue': ('event', 'CommandQueueRPC'),
+        'event': ('event', 'EventRPC'),
+        'event.trigger': ('event', 'EventTriggerRPC'),
+        'event.trigger.rule': ('event', 'EventTriggerRuleRPC'),
+        'event.trigger.rule.python': ('event', 'EventTriggerRulePythonRPC'),
+        }
+
 class Transport(object):
     """A siptrack xmlrpc transport.
 
@@ -94,12 +153,28 @@ class Transport(object):
     A connection is not made to the server when this class is instantiated.
     instance.connect() must be used to connect to the server, before any
     commands are sent.
+
+    Connections to the server are kept alive and pooled (see
+    pool.PooledTransport), pool_size sets the maximum number of idle
+    connections kept open.
+
+    Paged fetch/search results are fetched ahead in a background thread,
+    fetch_read_ahead sets the maximum number of decoded pages (or chunks
+    of entries, see prefetch) queued ahead (0 disables read-ahead).
     """
-    def __init__(self, hostname = None, port = None, use_ssl = None):
+    def __init__(self, hostname = None, port = None, use_ssl = None,
+            pool_size = None):
         self.hostname = hostname
         self.port = port
         self.use_ssl = use_ssl
+        if pool_size is None:
+            pool_size = pool.default_pool_size
+        self.pool_size = pool_size
         self._connection = None
+        self._pooled_transport = None
+        self._batch_state = threading.local()
+        self.multicall_supported = True
+        self.fetch_read_ahead = prefetch.default_read_ahead
         self.session_id = None
         self.username = None
         self.password = None
@@ -107,69 +182,20 @@ class Transport(object):
         self.password_has_changed = False
 
         self.cmd = root.RootRPC(self)
-        self.cmd.container = container.ContainerRPC(self)
-        self.cmd.container.tree = container.ContainerTreeRPC(self)
-        self.cmd.counter = counter.CounterRPC(self)
-        self.cmd.counter.loop = counter.CounterLoopRPC(self)
-        self.cmd.device = device.DeviceRPC(self)
-        self.cmd.device.tree = device.DeviceTreeRPC(self)
-        self.cmd.device.category = device.DeviceCategoryRPC(self)
-        self.cmd.device.config = deviceconfig.DeviceConfigRPC(self)
-        self.cmd.device.config.template = deviceconfig.DeviceConfigTemplateRPC(self)
-        self.cmd.template = template.TemplateRPC(self)
-        self.cmd.template.device = template.DeviceTemplateRPC(self)
-        self.cmd.template.network = template.NetworkTemplateRPC(self)
-        self.cmd.template.rule = template.TemplateRuleRPC(self)
-        self.cmd.template.rule.password = template.TemplateRulePasswordRPC(self)
-        self.cmd.template.rule.assign_network = template.TemplateRuleAssignNetworkRPC(self)
-        self.cmd.template.rule.subdevice = template.TemplateRuleSubdeviceRPC(self)
-        self.cmd.template.rule.text = template.TemplateRuleTextRPC(self)
-        self.cmd.template.rule.fixed = template.TemplateRuleFixedRPC(self)
-        self.cmd.template.rule.regmatch = template.TemplateRuleRegmatchRPC(self)
-        self.cmd.template.rule.bool = template.TemplateRuleBoolRPC(self)
-        self.cmd.template.rule.int = template.TemplateRuleIntRPC(self)
-        self.cmd.template.rule.delete_attribute = template.TemplateRuleDeleteAttributeRPC(self)
-        self.cmd.template.rule.flush_nodes = template.TemplateRuleFlushNodesRPC(self)
-        self.cmd.template.rule.flush_associations = template.TemplateRuleFlushAssociationsRPC(self)
-        self.cmd.password = password.PasswordRPC(self)
-        self.cmd.password.key = password.PasswordKeyRPC(self)
-        self.cmd.password.subkey = password.SubKeyRPC(self)
-        self.cmd.password.tree = password.PasswordTreeRPC(self)
-        self.cmd.password.category = password.PasswordCategoryRPC(self)
-        self.cmd.user = user.UserRPC(self)
-        self.cmd.user.local = user.UserLocalRPC(self)
-        self.cmd.user.ldap = user.UserLDAPRPC(self)
-        self.cmd.user.ad = user.UserActiveDirectoryRPC(self)
-        self.cmd.user.manager = user.UserManagerRPC(self)
-        self.cmd.user.manager.local = user.UserManagerLocalRPC(self)
-        self.cmd.user.manager.ldap = user.UserManagerLDAPRPC(self)
-        self.cmd.user.manager.ad = user.UserManagerActiveDirectoryRPC(self)
-        self.cmd.user.group = user.UserGroupRPC(self)
-        self.cmd.user.group.ldap = user.UserGroupLDAPRPC(self)
-        self.cmd.user.group.ad = user.UserGroupActiveDirectoryRPC(self)
-        self.cmd.view = view.ViewRPC(self)
-        self.cmd.view.tree = view.ViewTreeRPC(self)
-        self.cmd.network = network.NetworkRPC(self)
-        self.cmd.network.tree = network.NetworkTreeRPC(self)
-        self.cmd.network.ipv4 = network.NetworkIPV4RPC(self)
-        self.cmd.network.ipv6 = network.NetworkIPV6RPC(self)
-        self.cmd.network.range = network.NetworkRangeRPC(self)
-        self.cmd.network.range.ipv4 = network.NetworkRangeIPV4RPC(self)
-        self.cmd.network.range.ipv6 = network.NetworkRangeIPV6RPC(self)
-        self.cmd.attribute = attribute.AttributeRPC(self)
-        self.cmd.attribute.versioned = attribute.VersionedAttributeRPC(self)
-        self.cmd.attribute.encrypted = attribute.EncryptedAttributeRPC(self)
-        self.cmd.config = confignode.ConfigRPC(self)
-        self.cmd.config.section = confignode.ConfigSectionRPC(self)
-        self.cmd.config.network_autoassign = confignode.ConfigNetworkAutoassignRPC(self)
-        self.cmd.config.value = confignode.ConfigValueRPC(self)
-        self.cmd.permission = permission.PermissionRPC(self)
-        self.cmd.command = event.CommandRPC(self)
-        self.cmd.command.queue = event.CommandQueueRPC(self)
-        self.cmd.event = event.EventRPC(self)
-        self.cmd.event.trigger = event.EventTriggerRPC(self)
-        self.cmd.event.trigger.rule = event.EventTriggerRuleRPC(self)
-        self.cmd.event.trigger.rule.python = event.EventTriggerRulePythonRPC(self)
+
+    def _createSection(self, path):
+        """Create the transport section at path (eg. 'device.tree').
+
+        Returns None for unknown sections.
+        """
+        if path not in rpc_sections:
+            return None
+        module_name, class_name = rpc_sections[path]
+        module = __import__('siptracklib.transport.xmlrpc.%s' % (module_name),
+                fromlist = [class_name])
+        section = getattr(module, class_name)(self)
+        section.section_path = path
+        return section
 
     def _sendCommand(self, command, *args):
         """Send a command to the siptrack server, with error handling.
@@ -190,38 +216,67 @@ class Transport(object):
                 print 'RPC CALL %s: %s' % (command, end - start)
             return ret
         except xmlrpclib.Fault, e:
-            faultcode = e.faultCode
-            faultstring = e.faultString
-            # Generic error.
-            if faultcode == 1:
-                raise SiptrackError(faultstring)
-            # Invalid session ID.
-            elif faultcode == 99:
-                raise SiptrackError('Invalid session id.')
-            # Generic client error (invalid input etc).
-            elif faultcode == 101:
-                raise SiptrackError('CLIENT ERROR: %s' % (faultstring))
-            # Object already exists error.
-            elif faultcode == 102:
-                raise AlreadyExists(faultstring)
-            # Object doesn't exist error.
-            elif faultcode == 103:
-                raise NonExistent(faultstring)
-            # Invalid location error.
-            elif faultcode == 104:
-                raise InvalidLocation(faultstring)
-            # Invalid username/password for login.
-            elif faultcode == 105:
-                raise siptracklib.errors.InvalidLoginError(faultstring)
-            elif faultcode == 106:
-                raise siptracklib.errors.PermissionDenied(faultstring)
-            # Twisted xmlrpc error codes.
-            elif faultcode in [8001, 8002]:
-                raise SiptrackError('XMLRPC ERROR: %s' % (faultstring))
-            # If the predefined error codes didn't match, the server
-            # probably had problems of some kind.
-            else:
+            error = self._convertFault(e.faultCode, e.faultString)
+            if error is None:
                 raise
+            raise error
+
+    def _convertFault(self, faultcode, faultstring):
+        """Convert an xmlrpc fault to a matching siptrack exception.
+
+        Returns None if the fault code is unknown.
+        """
+        # Generic error.
+        if faultcode == 1:
+            return SiptrackError(faultstring)
+        # Invalid session ID.
+        elif faultcode == 99:
+            return SiptrackError('Invalid session id.')
+        # Generic client error (invalid input etc).
+        elif faultcode == 101:
+            return SiptrackError('CLIENT ERROR: %s' % (faultstring))
+        # Object already exists error.
+        elif faultcode == 102:
+            return AlreadyExists(faultstring)
+        # Object doesn't exist error.
+        elif faultcode == 103:
+            return NonExistent(faultstring)
+        # Invalid location error.
+        elif faultcode == 104:
+            return InvalidLocation(faultstring)
+        # Invalid username/password for login.
+        elif faultcode == 105:
+            return siptracklib.errors.InvalidLoginError(faultstring)
+        elif faultcode == 106:
+            return siptracklib.errors.PermissionDenied(faultstring)
+        # Twisted xmlrpc error codes.
+        elif faultcode in [8001, 8002]:
+            return SiptrackError('XMLRPC ERROR: %s' % (faultstring))
+        # If the predefined error codes didn't match, the server
+        # probably had problems of some kind.
+        return None
+
+    def _getBatch(self):
+        return getattr(self._batch_state, 'batch', None)
+
+    def batch(self, max_calls = multicall.default_max_calls):
+        """Return a context manager batching commands sent from this thread.
+
+        While the batch is active commands sent with BaseRPC.send are
+        queued and return multicall.BatchResult objects rather than the
+        actual command result. The queued commands are sent in a single
+        system.multicall request when the batch is flushed (when leaving
+        the with block or whenever max_calls commands are queued).
+        Only commands whose return value isn't needed right away (setting
+        attribute values, associations etc.) should be sent in a batch.
+
+            with transport.batch():
+                for attr in attributes:
+                    attr.value = 'new value'
+
+        Nested batches are merged into the outermost batch.
+        """
+        return multicall.Batch(self, max_calls)
 
     def section(self, class_id):
         """Return the transport section matching the given class_id."""
@@ -246,7 +301,11 @@ class Transport(object):
         else:
             scheme = 'http'
         connect_string = '%s://%s:%s/' % (scheme, self.hostname, self.port)
-        self._connection = xmlrpclib.ServerProxy(connect_string)
+        if self._pooled_transport is None:
+            self._pooled_transport = pool.PooledTransport(self.use_ssl,
+                    self.pool_size)
+        self._connection = xmlrpclib.ServerProxy(connect_string,
+                transport = self._pooled_transport)
         try:
             if session_id:
                 self.session_id = session_id
@@ -281,6 +340,15 @@ class Transport(object):
             return
         self.cmd.logout()
         self._connection = None
+        self._pooled_transport.close()
+        self._pooled_transport = None
+
+    def poolStats(self):
+        """Return connection pool hit/miss counters."""
+        if self._pooled_transport is None:
+            return {'hits': 0, 'misses': 0, 'idle': 0,
+                    'pool_size': self.pool_size}
+        return self._pooled_transport.stats()
 
     def _makeBinary(self, string):
         """Create a binary object for sending with xmlrpclib."""
@@ -149,38 +149,72 @@ def traverse_tree_reverse(root, include_root):
     if include_root:
         yield root
 
+def sort_key(node):
+    """Key function for sorting lists of nodes.
+
+    Nodes are grouped by sort_type and ordered by their sortKey within
+    each group.
+    """
+    return (node.sort_type, node.sortKey())
+
 def traverse_list(entries, filter = None, sorted = False):
     """Walk a list using the given filter (if any)."""
     if sorted:
         entries = list(entries)
-        entries.sort()
+        entries.sort(key = sort_key)
     if filter == None:
         filter = filter_include
     for ent in entries:
         if filter.filter(ent) == filter.result_match:
             yield ent
 
+# Shared by all nodes without children/associations/references, replaced
+# by a list when the first entry is added.
+empty_list = ()
+
+attribute_class_names = (
+    'attribute',
+    'versioned attribute',
+    'encrypted attribute'
+)
+
 class BaseNode(object):
     """Base class for all objects in the tree.
 
     This class is inherited by all regular tree objects, views,
     containers etc.
+
+    BaseNode and the most common node types use __slots__ to keep the
+    memory used per node down, subclasses that don't define __slots__
+    get a regular __dict__.
     """
+    __slots__ = ('oid', 'children', 'parent', 'root', 'transport_root',
+            'transport', 'fetched_children', 'sorted_children',
+            '_associations', '_references', 'ctime', '_attribute_index',
+            '_sort_key')
     sort_type = 'default'
 
     def __init__(self, parent):
         self.oid = None
-        self.children = []
+        self.children = empty_list
         self.parent = parent
         self.root = parent.root
         self.transport_root = parent.transport_root
         self.transport = self.transport_root.section(self.class_id)
-        self.attributes = AttributeDict(self)
         self.fetched_children = False
         self.sorted_children = False
-        self._associations = []
-        self._references = []
+        self._associations = empty_list
+        self._references = empty_list
         self.ctime = 0
+        # Attribute children indexed by lowercased name, see
+        # _indexAttribute.
+        self._attribute_index = None
+        # Cached result of sortKey, reset when the name attribute changes.
+        self._sort_key = None
+
+    def _get_attributes(self):
+        return AttributeDict(self)
+    attributes = property(_get_attributes)
 
     def describe(self):
         """Return a descriptive string for this node."""
@@ -201,6 +235,31 @@ class BaseNode(object):
                }
         return data
 
+    def sortKey(self):
+        """Return the key used to order nodes of the same sort_type.
+
+        Nodes with a name attribute are ordered by (lowercased) name
+        before nodes without one, which are ordered by class name.
+        The key is cached until the name attribute changes.
+        """
+        if self._sort_key is None:
+            attr = self._lookupAttribute('name')
+            name = None
+            if attr is not None:
+                name = attr.value
+            if name is None:
+                self._sort_key = (1, self.class_name)
+            else:
+                if isinstance(name, basestring):
+                    name = name.lower()
+                self._sort_key = (0, name)
+        return self._sort_key
+
+    def _invalidateSortKey(self):
+        self._sort_key = None
+        if isinstance(self.parent, BaseNode):
+            self.parent.sorted_children = False
+
     def __lt__(self, other):
         if not isinstance(other, BaseNode):
             return False
@@ -239,10 +298,72 @@ class BaseNode(object):
             raise errors.SiptrackError(
                     'trying to create child of invalid type \'%s\' for type \'%s\' (oid: %s)' % (class_id, self.class_id, self.oid))
         child = object_registry.createObject(class_id, self, *args, **kwargs)
-        self.children.append(child)
-        self._children_sorted = False
+        self._appendChild(child)
+        self.sorted_children = False
+        # Loaded attributes don't have a name until they have been loaded,
+        # they are indexed by loadChild instead.
+        if child.class_name in attribute_class_names and \
+                child.name is not None:
+            self._indexAttribute(child)
         return child
 
+    def _appendChild(self, child):
+        if not self.children:
+            self.children = [child]
+        else:
+            self.children.append(child)
+
+    def _indexAttribute(self, attr):
+        """Add an attribute child to the attribute index.
+
+        The index maps lowercased attribute names to the attribute, or
+        a list of attributes if several attributes share the same
+        lowercased name.
+        """
+        if self._attribute_index is None:
+            self._attribute_index = {}
+        key = attr.name.lower()
+        if key == 'name':
+            self._invalidateSortKey()
+        entry = self._attribute_index.get(key)
+        if entry is None:
+            self._attribute_index[key] = attr
+        elif type(entry) == list:
+            entry.append(attr)
+        else:
+            self._attribute_index[key] = [entry, attr]
+
+    def _unindexAttribute(self, attr):
+        if not self._attribute_index or attr.name is None:
+            return
+        key = attr.name.lower()
+        if key == 'name':
+            self._invalidateSortKey()
+        entry = self._attribute_index.get(key)
+        if entry is attr:
+            del self._attribute_index[key]
+        elif type(entry) == list and attr in entry:
+            entry = [a for a in entry if a is not attr]
+            if len(entry) == 1:
+                entry = entry[0]
+            self._attribute_index[key] = entry
+
+    def _lookupAttribute(self, name):
+        """Return the attribute matching name.
+
+        Exact matches are preferred, otherwise the first case-insensitive
+        match is returned. Returns None if no attribute matches.
+        """
+        if not self._attribute_index:
+            return None
+        entry = self._attribute_index.get(name.lower())
+        if type(entry) != list:
+            return entry
+        for attr in entry:
+            if attr.name == name:
+                return attr
+        return entry[0]
+
     def addChildByID(self, class_id, *args, **kwargs):
         child = self.createChildByID(class_id, *args, **kwargs)
         try:
@@ -272,6 +393,8 @@ class BaseNode(object):
             self.root.removedOID(node_data['oid'])
             child._delete()
             raise
+        if child.class_name in attribute_class_names:
+            self._indexAttribute(child)
         return child
 
     def _created(self):
@@ -293,8 +416,8 @@ class BaseNode(object):
         if len(node_data['data']) != self.class_data_len:
             raise errors.InvalidServerData('%s: %s' % (node_data['class_id'], node_data['data']))
         self.oid = node_data['oid']
-        self._associations = node_data['associations']
-        self._references = node_data['references']
+        self._associations = node_data['associations'] or empty_list
+        self._references = node_data['references'] or empty_list
         self.ctime = node_data['ctime']
 
     def delete(self):
@@ -309,6 +432,8 @@ class BaseNode(object):
     def _delete(self):
         if self.oid is not None:
             self.root.removedOID(self.oid)
+        if self.class_name in attribute_class_names:
+            self.parent._unindexAttribute(self)
         self.parent.children.remove(self)
         self.oid = None
         self.transport = None
@@ -324,19 +449,31 @@ class BaseNode(object):
         do it locally.
         """
         self.transport_root.cmd.moveOID(self.oid, new_parent.oid)
+        if self.class_name in attribute_class_names:
+            self.parent._unindexAttribute(self)
+            new_parent._indexAttribute(self)
         self.parent.children.remove(self)
-        new_parent.children.append(self)
+        new_parent._appendChild(self)
+        new_parent.sorted_children = False
         self.parent = new_parent
 
     def associate(self, other):
         self.transport_root.cmd.associate(self.oid, other.oid)
+        if not self._associations:
+            self._associations = []
         self._associations.append(other.oid)
+        if not other._references:
+            other._references = []
         other._references.append(self.oid)
 
     def disassociate(self, other):
         """Remove an association to another object."""
         self.transport_root.cmd.disassociate(self.oid, other.oid)
+        if not self._associations:
+            self._associations = []
         self._associations.remove(other.oid)
+        if not other._references:
+            other._references = []
         other._references.remove(self.oid)
 
     def unlink(self, other):
@@ -359,26 +496,14 @@ class BaseNode(object):
         return ret
 
     def _get_associations(self):
-        for oid in self._associations:
-            try:
-                node = self.root.getOID(oid)
-            except errors.NonExistent:
-                continue
-            if node:
-                yield node
+        return iter(self.root.resolveOIDs(self._associations))
 
     def _set_associations(self, value):
         return
     associations = property(_get_associations, _set_associations)
 
     def _get_references(self):
-        for oid in self._references:
-            try:
-                node = self.root.getOID(oid)
-            except errors.NonExistent:
-                continue
-            if node:
-                yield node
+        return iter(self.root.resolveOIDs(self._references))
 
     def _set_references(self, value):
         return
@@ -393,10 +518,8 @@ class BaseNode(object):
         return list(traverse_list(self.references, node_filter, sorted))
 
     def _iterAssocRef(self):
-        for link in self.references:
-            yield link
-        for link in self.associations:
-            yield link
+        return iter(self.root.resolveOIDs(
+            list(self._references) + list(self._associations)))
 
     def listLinks(self, include = [], exclude = [], sorted = True):
         node_filter = NodeFilter(include, exclude, no_match_break = False)
@@ -411,6 +534,45 @@ class BaseNode(object):
                                                        include_associations,
                                                        include_references):
             self.root.loadChildren(data, force)
+        self._markFetched(max_depth)
+
+    def iterFetch(self, max_depth, include_parents = True,
+            include_associations = True,
+            include_references = True):
+        """Fetch like fetch, yielding nodes as they are loaded.
+
+        Each newly loaded node is yielded as soon as it has been loaded
+        (parents before children), so nodes can be processed while the
+        rest of the fetch is still being received. Nodes that were
+        already loaded are not yielded.
+        """
+        root = self.root
+        oid_mapping = root.oid_mapping
+        for data in self.transport_root.cmd.iterFetchIterator(self.oid, max_depth,
+                                                       include_parents,
+                                                       include_associations,
+                                                       include_references):
+            for node_data in data:
+                new = node_data['oid'] not in oid_mapping
+                root.loadChildren((node_data,))
+                if new:
+                    node = oid_mapping.get(node_data['oid'])
+                    if node is not None:
+                        yield node
+        self._markFetched(max_depth)
+
+    def _markFetched(self, max_depth):
+        """Flag nodes whose children were all loaded by a fetch.
+
+        After a fetch to max_depth all nodes above max_depth have
+        their children loaded, see fetched_children.
+        """
+        if max_depth == 0:
+            return
+        if max_depth != -1:
+            max_depth -= 1
+        for node in traverse_tree_depth_first(self, True, max_depth):
+            node.fetched_children = True
 
     def traverse(self, include_self = True, max_depth = -1,
             include = [], exclude = [], no_match_break = False,
@@ -434,14 +596,16 @@ class BaseNode(object):
                 include = include, exclude = exclude, sorted = sorted))
 
     def search(self, re_pattern, attr_limit = [], include = [], exclude = [],
-            no_match_break = False, sorted = True):
+            no_match_break = False, sorted = True, prefetch_links = False):
         oids = []
         for data, _oids in self.transport_root.cmd.iterSearchIterator(self.oid, re_pattern, attr_limit,
                 include, exclude, no_match_break, False, False, False, False):
             oids.extend(_oids)
         nodes = list(self.root.getOIDs(oids))
+        if prefetch_links:
+            self.root.prefetchLinks(nodes)
         if sorted:
-            nodes.sort()
+            nodes.sort(key = sort_key)
         return nodes
 
     def localSearch(self, re_pattern, attr_limit = [], include = [],
@@ -530,20 +694,15 @@ class BaseNode(object):
     def sortChildren(self):
         """Sort the children stored for this node.
 
-        To get as proper sorting as possible, sort groups
-        of nodes that are 'sorting compatible'.
+        To get as proper sorting as possible, nodes are grouped
+        by sort_type, see sort_key. The sort order is kept until
+        children are added or a childs name changes.
         """
         if self.sorted_children is False:
             self.sorted_children = True
-            stypes = {}
-            for child in self.children:
-                if child.sort_type not in stypes:
-                    stypes[child.sort_type] = []
-                stypes[child.sort_type].append(child)
-            self.children = []
-            for children in stypes.itervalues():
-                children.sort()
-                self.children += children
+            if not self.children:
+                return
+            self.children.sort(key = sort_key)
 
     def prettyCtime(self):
         return time.ctime(self.ctime)
@@ -582,38 +741,20 @@ class AttributeDict(object):
         # DO NOT SET SORTED = True.
         # Since sorting lists the compared objects attributes this will
         # result in a whole lot of sorting..
-        local_types = [
-            'attribute',
-            'versioned attribute',
-            'encrypted attribute'
-        ]
         return self.real.listChildren(
             fetch = False,
-            include = local_types,
+            include = attribute_class_names,
             sorted = False
         )
 
     def __getitem__(self, item):
-        for attr in self._listAttributes():
-            if attr.name == item:
-                return attr.value
-        # If nothing is found, try case-insensitive match.
-        item = item.lower()
-        for attr in self._listAttributes():
-            if attr.name.lower() == item:
-                return attr.value
-        raise TypeError('attribute not found in AttributeDict')
+        attr = self.real._lookupAttribute(item)
+        if attr is None:
+            raise TypeError('attribute not found in AttributeDict')
+        return attr.value
 
     def __contains__(self, item):
-        for attr in self._listAttributes():
-            if attr.name == item:
-                return True
-        # If nothing is found, try case-insensitive match.
-        item = item.lower()
-        for attr in self._listAttributes():
-            if attr.name.lower() == item:
-                return True
-        return False
+        return self.real._lookupAttribute(item) is not None
 
     def __setitem__(self, item, value):
         atype = 'text'
@@ -626,28 +767,35 @@ class AttributeDict(object):
         elif type(value) == int:
             atype = 'int'
         attr_exists = False
-        for attr in self._listAttributes():
-            if attr.name == item:
-                attr.value = value
-                attr_exists = True
+        for attr in self._listExact(item):
+            attr.value = value
+            attr_exists = True
         if not attr_exists:
             attribute = self.real.add('attribute', item, atype, value)
 
+    def _listExact(self, item):
+        """Return all attributes named exactly item."""
+        index = self.real._attribute_index
+        if not index:
+            return []
+        entry = index.get(item.lower())
+        if entry is None:
+            return []
+        if type(entry) != list:
+            entry = [entry]
+        return [attr for attr in entry if attr.name == item]
+
     def get(self, item, default = None):
-        if item in self:
-            return self[item]
-        return default
+        attr = self.real._lookupAttribute(item)
+        if attr is None:
+            return default
+        return attr.value
 
     def getObject(self, item, default = None):
-        for attr in self._listAttributes():
-            if attr.name == item:
-                return attr
-        # If nothing is found, try case-insensitive match.
-        item = item.lower()
-        for attr in self._listAttributes():
-            if attr.name.lower() == item:
-                return attr
-        return default
+        attr = self.real._lookupAttribute(item)
+        if attr is None:
+            return default
+        return attr
 
 class NodeList(object):
     def __init__(self, parent, nodes = None):
@@ -2,13 +2,14 @@ import codecs
 import sys
 import getpass
 import os
-import urllib
+import errno
 
 import siptracklib
 from siptracklib import errors
 from siptracklib import win32utils
 
 def parse_connection_string(cs):
+    import urllib
     ret = {}
     if cs.startswith('st://'):
         ret['scheme'] = 'st'
@@ -81,6 +82,12 @@ def encode_noerr(string):
     """
     return string.encode(siptracklib.user_encoding, 'replace')
 
+def _getpass(prompt):
+    # Commands run by a siptrack agent prompt in the client, see agent.py.
+    if hasattr(sys.stdin, 'getpass'):
+        return sys.stdin.getpass(prompt)
+    return getpass.getpass(prompt)
+
 def read_password(msg = 'Enter password', verify = True,
                   use_stderr = True):
     """Get a password from the user.
@@ -94,9 +101,9 @@ def read_password(msg = 'Enter password', verify = True,
         old_stdout = sys.stdout
         sys.stdout = sys.stderr
         while not match:
-            password = getpass.getpass(msg)
+            password = _getpass(msg)
             if verify:
-                verify_password = getpass.getpass('Re-enter for verification: ')
+                verify_password = _getpass('Re-enter for verification: ')
                 if password != verify_password:
                     cprint('Passwords don\'t match.')
                 else:
@@ -244,10 +251,12 @@ def search_device(st, searchstring, attr_limit = [], quick = True, max_results =
     if quick:
         result = st.quicksearch(searchstring, attr_limit,
                                 include = ['device', 'ipv4 network', 'ipv6 network'],
-                                max_results = max_results)
+                                max_results = max_results,
+                                prefetch_links = True)
     else:
         result = st.search(searchstring, attr_limit,
-                include = ['device', 'ipv4 network', 'ipv6 network'])
+                include = ['device', 'ipv4 network', 'ipv6 network'],
+                prefetch_links = True)
     devices = set()
     for node in result:
         if node.class_name == 'device':
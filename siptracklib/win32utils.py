@@ -1,10 +1,14 @@
 import os
+import sys
 
-try:
-    import ctypes
-    has_ctypes = True
-except ImportError:
-    has_ctypes = False
+# ctypes is only used (and imported) on windows.
+has_ctypes = False
+if sys.platform == 'win32':
+    try:
+        import ctypes
+        has_ctypes = True
+    except ImportError:
+        pass
 
 MAX_PATH = 260
 CSIDL_APPDATA = 0x001A